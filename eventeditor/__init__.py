@@ -1,3 +1,6 @@
-
-from . import _version
-__version__ = _version.get_versions()['version']
+def __getattr__(name: str):
+    # Resolving the version may run git (in a source checkout), so it is only done on demand.
+    if name == '__version__':
+        from . import _version
+        return _version.get_versions()['version']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
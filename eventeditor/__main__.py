@@ -1,6 +1,11 @@
+import time
+# Recorded before anything else is imported so that --profile-startup includes import time.
+_START_TIME = time.perf_counter()
+
 import argparse
 import gzip
 import os
+from pathlib import Path
 import signal
 import sys
 import traceback
@@ -11,23 +16,33 @@ from evfl import EventFlow
 import eventeditor.ai as ai
 import eventeditor.actor_json as aj
 from eventeditor.actor_view import ActorView
+from eventeditor.background_task import run_task, Task, TaskCancelled
 from eventeditor.event_view import EventView
+from eventeditor.flow_cache import FlowCache
 from eventeditor.flow_data import FlowData, FlowDataChangeReason
 from eventeditor.flowchart_view import FlowchartView
+import eventeditor.journal as journal
+import eventeditor.pack_io as pack_io
 import eventeditor.util as util
 import PyQt5.QtCore as qc # type: ignore
 import PyQt5.QtGui as qg # type: ignore
 import PyQt5.QtWidgets as q # type: ignore
-from . import _version
+from eventeditor.startup_profiler import StartupProfiler
+
+# A --startup-budget run gives up (and fails) after this many times the budget, or this many milliseconds.
+_STARTUP_TIMEOUT_FACTOR = 10
+_MIN_STARTUP_TIMEOUT_MS = 10000
 
 class MainWindow(q.QMainWindow):
-    def __init__(self, args) -> None:
+    def __init__(self, args, profiler: typing.Optional[StartupProfiler] = None) -> None:
         super().__init__()
         self.args = args
+        self.profiler = profiler
         self.flow: typing.Optional[EventFlow] = None
         self.flow_data = FlowData()
         self.flow_path = ''
         self.unsaved = False
+        self.flow_cache = self.createFlowCache()
 
         self.initMenu()
         self.initWidgets()
@@ -36,20 +51,59 @@ class MainWindow(q.QMainWindow):
         self.connectWidgets()
         self.centralWidget().setHidden(True)
         self.updateTitleAndActions()
+        self.markStartupPhase('window')
 
         self.readSettings()
+        self.markStartupPhase('settings')
+
+    def createFlowCache(self) -> typing.Optional[FlowCache]:
+        max_size_mb = qc.QSettings().value('cache/max_size_mb', 256, type=int)
+        cache_dir = qc.QStandardPaths.writableLocation(qc.QStandardPaths.CacheLocation)
+        if max_size_mb <= 0 or not cache_dir:
+            return None
+        try:
+            return FlowCache(Path(cache_dir)/'flows', max_size_mb << 20)
+        except OSError:
+            traceback.print_exc()
+            return None
 
-        self.initVersionInfo()
+    def markStartupPhase(self, phase: str) -> None:
+        if self.profiler:
+            self.profiler.mark(phase)
 
-    def initVersionInfo(self) -> None:
-        versions = _version.get_versions()
-        self._version: str = versions['version']
-        self._version_rev: str = versions['full-revisionid']
+    def finishStartupProfile(self) -> None:
+        if not self.profiler:
+            return
+        profiler = self.profiler
+        self.profiler = None
+        profiler.report()
+        budget = self.args.startup_budget
+        if budget is not None:
+            over_budget = profiler.total_ms() > budget
+            if over_budget:
+                print(f'Startup took {profiler.total_ms():.1f} ms, which exceeds the budget of {budget:.1f} ms', file=sys.stderr)
+            # The event loop may not be running yet.
+            qc.QTimer.singleShot(0, lambda: q.QApplication.exit(1 if over_budget else 0))
+
+    def onStartupTimeout(self) -> None:
+        """Ends a --startup-budget run that never finished (e.g. because the web view never became ready)."""
+        if not self.profiler:
+            return
+        profiler = self.profiler
+        self.profiler = None
+        profiler.mark('timed out')
+        profiler.report()
+        print(f'Startup did not finish within {profiler.total_ms():.1f} ms', file=sys.stderr)
+        qc.QTimer.singleShot(0, lambda: q.QApplication.exit(1))
 
     def show(self) -> None:
         super().show()
-        if self.args.event_flow_file:
-            self.readFlow(self.args.event_flow_file)
+        if self.args.event_flow_file and self.readFlow(self.args.event_flow_file):
+            # The profile is finished once the flowchart view is ready (see onViewReady).
+            self.markStartupPhase('first file loaded')
+        else:
+            self.markStartupPhase('window shown')
+            self.finishStartupProfile()
 
     def initMenu(self) -> None:
         menu = self.menuBar()
@@ -65,7 +119,7 @@ class MainWindow(q.QMainWindow):
         file_menu.addAction(self.open_action)
         file_menu.addSeparator()
         self.open_autosave_action = q.QAction('Open autosave...', self)
-        self.open_autosave_action.triggered.connect(lambda: self.onOpenFile(str(self.flow_data.auto_save.get_directory()), name_filter=f'Flowchart autosave (autosave_{self.flow_data.flow.name}_*.bfevfl.gz)'))
+        self.open_autosave_action.triggered.connect(lambda: self.onOpenFile(str(self.flow_data.auto_save.get_directory()), name_filter=self.flow_data.auto_save.get_name_filter(self.flow_data.flow.name)))
         if not self.flow_data.auto_save.get_directory():
             self.open_autosave_action.setVisible(False)
         file_menu.addAction(self.open_autosave_action)
@@ -125,13 +179,31 @@ class MainWindow(q.QMainWindow):
         github_repo_action.triggered.connect(lambda: qg.QDesktopServices.openUrl(qc.QUrl('https://github.com/leoetlino/event-editor')))
         help_menu.addAction(github_repo_action)
         help_menu.addSeparator()
+        statistics_action = q.QAction('Statistics', self)
+        statistics_action.triggered.connect(self.showStatistics)
+        help_menu.addAction(statistics_action)
         about_action = q.QAction('About', self)
         about_action.triggered.connect(self.about)
         help_menu.addAction(about_action)
 
     def about(self) -> None:
-        q.QMessageBox.about(self, 'About EventEditor', f'<h2>EventEditor</h2><p>EventEditor is an open-source event flow editor for <i>The Legend of Zelda: Breath of the Wild.</i></p><p><small>Version: {self._version}<br>Revision: {self._version_rev}</small></p>')
-        pass
+        # Builds contain a static _version.py (written by versioneer), but in a source checkout
+        # this runs git, so it is only done when needed.
+        from . import _version
+        versions = _version.get_versions()
+        q.QMessageBox.about(self, 'About EventEditor', f'<h2>EventEditor</h2><p>EventEditor is an open-source event flow editor for <i>The Legend of Zelda: Breath of the Wild.</i></p><p><small>Version: {versions["version"]}<br>Revision: {versions["full-revisionid"]}</small></p>')
+
+    def showStatistics(self) -> None:
+        lines = []
+        autosave_stats = self.flow_data.auto_save.get_stats()
+        if autosave_stats:
+            lines.append(f'<b>Autosave</b><br>{autosave_stats["requested"]} requested, {autosave_stats["dropped"]} coalesced, '
+                         f'{autosave_stats["completed"]} written, {autosave_stats["depth"]} pending<br>'
+                         f'Last snapshot: {autosave_stats["serialize_time"] * 1000:.1f} ms, last write: {autosave_stats["write_time"] * 1000:.1f} ms')
+        if self.flow_cache:
+            cache_stats = self.flow_cache.get_stats()
+            lines.append(f'<b>Flow cache</b><br>{cache_stats["hits"]} hits, {cache_stats["misses"]} misses ({cache_stats["hit_ratio"]:.0%} hit ratio)')
+        q.QMessageBox.information(self, 'Statistics', '<p>' + '</p><p>'.join(lines or ['No statistics available.']) + '</p>')
 
     def initWidgets(self) -> None:
         self.tab_widget = q.QTabWidget(self)
@@ -178,7 +250,7 @@ class MainWindow(q.QMainWindow):
         ret = q.QMessageBox.question(self, 'Unsaved changes', f'{self.flow.name} has unsaved changes. Save changes before closing?', q.QMessageBox.Yes | q.QMessageBox.No | q.QMessageBox.Cancel)
 
         if ret == q.QMessageBox.Yes:
-            self.writeFlow(self.flow_path)
+            self.onSaveFile()
             self.writeSettings()
             event.accept()
         elif ret == q.QMessageBox.No:
@@ -225,17 +297,17 @@ class MainWindow(q.QMainWindow):
             indicator = '*' if self.unsaved else ''
             self.setWindowTitle(f'EventEditor - {indicator}{self.flow.name}')
 
-        self.open_autosave_action.setEnabled(bool(self.flow) and bool(self.flow_path))
+        self.open_autosave_action.setEnabled(bool(self.flow))
         self.save_action.setEnabled(bool(self.flow) and bool(self.flow_path))
         self.save_as_action.setEnabled(bool(self.flow))
-        self.rename_flow_action.setEnabled(bool(self.flow) and bool(self.flow_path))
+        self.rename_flow_action.setEnabled(bool(self.flow))
 
-        self.reload_graph_action.setEnabled(bool(self.flow) and bool(self.flow_path))
+        self.reload_graph_action.setEnabled(bool(self.flow))
         self.export_graph_action.setEnabled(bool(self.flow))
         self.export_definitions_action.setEnabled(bool(self.flow))
         self.reorder_event_parameters_action.setEnabled(bool(self.flow))
-        self.add_event_action.setEnabled(bool(self.flow) and bool(self.flow_path))
-        self.add_fork_action.setEnabled(bool(self.flow) and bool(self.flow_path))
+        self.add_event_action.setEnabled(bool(self.flow))
+        self.add_fork_action.setEnabled(bool(self.flow))
 
     def renameFlow(self) -> None:
         if not self.flow or not self.flow.flowchart:
@@ -251,19 +323,28 @@ class MainWindow(q.QMainWindow):
         if self.flow and self.unsaved:
             ret = q.QMessageBox.question(self, 'Unsaved changes', f'{self.flow.name} has unsaved changes. Save changes before opening another file?', q.QMessageBox.Yes | q.QMessageBox.No | q.QMessageBox.Cancel)
             if ret == q.QMessageBox.Yes:
-                self.writeFlow(self.flow_path)
+                self.onSaveFile()
             elif ret == q.QMessageBox.Cancel:
                 return False
 
-        try:
+        def load(task: Task) -> EventFlow:
             flow = EventFlow()
-            util.read_flow(path, flow)
+            util.read_flow(path, flow, progress=task.report_progress, cache=self.flow_cache)
+            return flow
+
+        try:
+            # Parsing is done in the background; the model is only swapped once it has finished.
+            flow = run_task(self, 'Open', f'Loading {os.path.basename(path)}...', load, wait_on_cancel=False)
+            # A flow that was recovered from an autosave journal must be saved somewhere else.
+            is_journal = journal.is_journal_path(path)
             self.flow = flow
-            self.flow_path = path
+            self.flow_path = '' if is_journal else path
             self.flow_data.setFlow(flow)
-            self.unsaved = False
+            self.unsaved = is_journal
             self.updateTitleAndActions()
             return True
+        except TaskCancelled:
+            return False
         except:
             traceback.print_exc()
             q.QMessageBox.critical(self, 'Open', 'Failed to load event flow')
@@ -273,12 +354,21 @@ class MainWindow(q.QMainWindow):
         if not self.flow or not path:
             return False
 
+        flow = self.flow
+        def save(task: Task) -> bool:
+            return util.write_flow_data(path, data, progress=task.report_progress)
+
         try:
-            util.write_flow(path, self.flow)
+            # evfl keeps state on the flow objects while serialising them, so this must not overlap
+            # with autosaves (which serialise on the main thread too). Only writing is done in the background.
+            data = util.serialize_flow(flow)
+            run_task(self, 'Save', f'Saving {flow.name}...', save)
             self.flow_path = path
             self.unsaved = False
             self.updateTitleAndActions()
             return True
+        except TaskCancelled:
+            return False
         except:
             traceback.print_exc()
             q.QMessageBox.critical(self, 'Save', 'Failed to write event flow. Please ensure there are no placeholder events left.')
@@ -300,14 +390,35 @@ class MainWindow(q.QMainWindow):
             return False
         return self.readFlow(path)
 
-    def onOpenFile(self, default_directory='', name_filter='Flowchart (*.bfevfl)') -> bool:
-        default_directory_ = default_directory if default_directory else self.flow_path
+    def onOpenFile(self, default_directory='', name_filter='Flowchart (*.bfevfl);;Archive (*.pack *.sbeventpack *.sarc *.ssarc)') -> bool:
+        default_directory_ = default_directory if default_directory else pack_io.split_pack_path(self.flow_path)[0]
         path = q.QFileDialog.getOpenFileName(self, 'Open event flowchart', default_directory_, name_filter)[0]
+        if path and pack_io.is_pack_archive(path):
+            path = self.selectFlowInArchive(path)
         if path:
             return self.readFlow(path)
         return False
 
+    def selectFlowInArchive(self, archive_path: str) -> str:
+        try:
+            paths = pack_io.list_pack_files(archive_path)
+        except:
+            traceback.print_exc()
+            q.QMessageBox.critical(self, 'Open', 'Failed to read archive')
+            return ''
+        if not paths:
+            q.QMessageBox.information(self, 'Open', 'This archive does not contain any event flow.')
+            return ''
+        names = [pack_io.split_pack_path(path)[1][-1] for path in paths]
+        name, ok = q.QInputDialog.getItem(self, 'Open', 'Select an event flow to open.', names, 0, False)
+        if not ok:
+            return ''
+        return paths[names.index(name)]
+
     def onSaveFile(self) -> None:
+        if not self.flow_path:
+            self.onSaveAsFile()
+            return
         self.writeFlow(self.flow_path)
 
     def onSaveAsFile(self) -> None:
@@ -321,6 +432,8 @@ class MainWindow(q.QMainWindow):
         self.centralWidget().setHidden(False)
         self.onEventNameVisibilityChanged()
         self.onEventParamVisibilityChanged()
+        self.markStartupPhase('web engine ready')
+        self.finishStartupProfile()
 
     def onEventSelected(self, event_idx: int) -> None:
         self.event_view.selectEvent(event_idx)
@@ -345,6 +458,9 @@ class MainWindow(q.QMainWindow):
         self.flowchart_view.eventParamVisibilityChanged.emit(visible)
 
 def main() -> None:
+    profiler = StartupProfiler(_START_TIME)
+    profiler.mark('imports')
+
     qc.QCoreApplication.setOrganizationName('eventeditor')
     qc.QCoreApplication.setApplicationName('eventeditor')
     qc.QSettings.setDefaultFormat(qc.QSettings.IniFormat)
@@ -353,14 +469,24 @@ def main() -> None:
 
     parser = argparse.ArgumentParser(prog='eventeditor', description='An event editor for Breath of the Wild')
     parser.add_argument('event_flow_file', nargs='?', help='Event flow file to open')
+    parser.add_argument('--profile-startup', action='store_true', help='Print how long each phase of startup takes')
+    parser.add_argument('--startup-budget', type=float, metavar='MS',
+                        help='Exit after startup (implies --profile-startup); the exit status is 1 if startup took longer than MS milliseconds')
     args, _ = parser.parse_known_args()
+    # Required to import PyQt5.QtWebEngineWidgets after the application has been created,
+    # which FlowchartView does lazily to speed up startup.
+    qc.QCoreApplication.setAttribute(qc.Qt.AA_ShareOpenGLContexts)
     app = q.QApplication(sys.argv)
     if os.name == 'nt':
         app_font = app.font()
         app_font.setFamily('Segoe UI')
         app_font.setPointSize(int(qg.QFontInfo(app_font).pointSize() * 1.20))
         app.setFont(app_font)
-    win = MainWindow(args)
+    profiler.mark('application')
+    win = MainWindow(args, profiler if args.profile_startup or args.startup_budget is not None else None)
+    if args.startup_budget is not None:
+        # A budget run must always exit, even if startup never finishes.
+        qc.QTimer.singleShot(int(max(args.startup_budget * _STARTUP_TIMEOUT_FACTOR, _MIN_STARTUP_TIMEOUT_MS)), win.onStartupTimeout)
     win.show()
     ret = app.exec_()
     sys.exit(ret)
@@ -5,7 +5,6 @@ from evfl import EventFlow
 from evfl.event import ActionEvent, SwitchEvent
 import json
 from pathlib import Path
-import PyQt5.QtWidgets as q
 
 _actor_definitions_path: typing.Optional[Path] = None
 def set_actor_definitions_path(p: typing.Optional[str]) -> None:
@@ -66,6 +65,7 @@ def load_queries(actor_name: str) -> typing.Optional[typing.Iterable[str]]:
 
 def export_definitions(flow: EventFlow, widget: typing.Optional['QWidget']) -> None:
     if not _actor_definitions_path:
+        import PyQt5.QtWidgets as q
         set_actor_definitions_path(q.QFileDialog.getSaveFileName(widget, 'Export actor definitions to...',  'actor_definitions', 'JSON (*.json)')[0])
 
     if not _actor_definitions_path:
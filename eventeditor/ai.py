@@ -1,11 +1,13 @@
-import aamp
-import byml
 from enum import IntEnum
 import functools
 import os
 from pathlib import Path
 import typing
-import oead
+
+# aamp, byml and oead are only needed once ROM data is read, so they are imported when needed
+# to keep them off the startup path.
+if typing.TYPE_CHECKING:
+    import aamp
 
 _rom_path: typing.Optional[Path] = None
 def set_rom_path(p: typing.Optional[str]) -> None:
@@ -42,6 +44,7 @@ class AIProg:
             root = _rom_path / rel_root
             aiprog_dir = root/'Actor'/'Pack'/f'{actor_name}.sbactorpack'/'Actor'/'AIProgram'
             for path in _list_aiprog_files(aiprog_dir):
+                import aamp
                 with open(path, 'rb') as aiprog:
                     pio = aamp.Reader(aiprog.read()).parse()
                 if self._do_load_actor_aiprog(pio):
@@ -49,7 +52,7 @@ class AIProg:
 
         return False
 
-    def _do_load_actor_aiprog(self, aiprog: aamp.ParameterIO) -> bool:
+    def _do_load_actor_aiprog(self, aiprog: 'aamp.ParameterIO') -> bool:
         try:
             param_root = aiprog.list('param_root')
             action_list = param_root.list('Action')
@@ -123,6 +126,8 @@ class AIDef:
         if self._ai_defs or not _rom_path:
             return
 
+        import byml
+        import oead
         raw_data = oead.yaz0.decompress(
             (_rom_path / 'Pack/Bootup.pack/Actor/AIDef/AIDef_Game.product.sbyml').read_bytes()
         )
@@ -0,0 +1,215 @@
+// Canvas 2D backend for the flowchart renderer.
+//
+// SVG needs several DOM elements per event, which gets slow for very large flowcharts even if only
+// the visible ones exist. This backend draws the scene to a single canvas instead: items of the same
+// style are batched into one path so that each frame only needs a handful of fill/stroke calls.
+// It only uses basic 2D context features, so it also works with software rendering.
+
+// Canvases cannot be styled with CSS, so these mirror main.css.
+const CANVAS_NODE_STYLES = {
+  entry: { fill: '#fff', label: '#303030' },
+  'entry unloaded': { fill: '#bbb', label: '#303030' },
+  action: { fill: '#555', label: '#fffeed' },
+  switch: { fill: '#0a62d6', label: '#fffeed' },
+  fork: { fill: '#999', label: '#303030' },
+  join: { fill: '#999', label: '#303030' },
+  sub_flow: { fill: '#c4371f', label: '#fffeed' },
+  region: { fill: '#6d4c9c', label: '#fffeed' },
+};
+const CANVAS_DEFAULT_NODE_STYLE = { fill: '#999', label: '#fffeed' };
+const CANVAS_NODE_STROKE = { color: '#333', width: 1.5 };
+const CANVAS_SELECTED_NODE_STROKE = { color: '#008ff7', width: 3 };
+const CANVAS_EDGE_STYLES = {
+  '': { stroke: '#888', width: 1.5, arrowhead: '#cecbcb' },
+  'selected-in-edge': { stroke: '#008ff7', width: 2, arrowhead: '#008ff7' },
+  'selected-out-edge': { stroke: '#ffffff', width: 2, arrowhead: '#ffffff' },
+};
+const CANVAS_EDGE_LABEL_COLOR = '#ffffff';
+const CANVAS_SELECTED_EDGE_LABEL_FONT = 'bold 15.4px "Helvetica Neue", Helvetica, Arial, sans-serif';
+// Labels are not drawn if they would be smaller than this (in screen pixels).
+const CANVAS_MIN_LABEL_SIZE = 3;
+// Arrowheads have the same shape and size as the SVG markers: a 10x10 viewBox that is scaled to fit
+// 8x6 stroke widths, with the reference point at (9, 5).
+const CANVAS_ARROWHEAD_SCALE = 0.6;
+
+function groupBy(items, getKey) {
+  const groups = new Map();
+  for (const item of items) {
+    const key = getKey(item);
+    const group = groups.get(key);
+    if (group) {
+      group.push(item);
+    } else {
+      groups.set(key, [item]);
+    }
+  }
+  return groups;
+}
+
+function addArrowhead(context, points, strokeWidth) {
+  const end = points[points.length - 1];
+  const prev = points[points.length - 2];
+  const length = Math.hypot(end.x - prev.x, end.y - prev.y) || 1;
+  const dx = (end.x - prev.x) / length;
+  const dy = (end.y - prev.y) / length;
+  const s = CANVAS_ARROWHEAD_SCALE * strokeWidth;
+  const baseX = end.x - dx * 9 * s;
+  const baseY = end.y - dy * 9 * s;
+  context.moveTo(end.x + dx * s, end.y + dy * s);
+  context.lineTo(baseX - dy * 5 * s, baseY + dx * 5 * s);
+  context.lineTo(baseX + dy * 5 * s, baseY - dx * 5 * s);
+  context.closePath();
+}
+
+/// Draws scenes to a canvas. Nodes are hit tested with the spatial index of the scene.
+class CanvasBackend {
+  constructor(renderer, canvas) {
+    this.renderer = renderer;
+    this.canvas = canvas;
+    this.context = canvas.getContext('2d');
+    this.canvas.style.display = 'none';
+  }
+
+  setScene() {
+    this.canvas.style.display = '';
+    this.update();
+  }
+
+  clear() {
+    this.context.setTransform(1, 0, 0, 1, 0, 0);
+    this.context.clearRect(0, 0, this.canvas.width, this.canvas.height);
+    this.canvas.style.display = 'none';
+  }
+
+  refreshLabels() {
+    this.renderer.scheduleViewportUpdate();
+  }
+
+  refreshSelection() {
+    this.renderer.scheduleViewportUpdate();
+  }
+
+  /// Returns the ID of the node at the specified point (in SVG element coordinates), or null.
+  hitTest([x, y]) {
+    const { scene, zoom } = this.renderer;
+    if (!scene) {
+      return null;
+    }
+    const [tx, ty] = zoom.translate();
+    const scale = zoom.scale();
+    const item = scene.hitTest((x - tx) / scale, (y - ty) / scale);
+    return item ? item.id : null;
+  }
+
+  resize() {
+    const ratio = window.devicePixelRatio || 1;
+    const width = Math.round(window.innerWidth * ratio);
+    const height = Math.round(window.innerHeight * ratio);
+    if (this.canvas.width !== width || this.canvas.height !== height) {
+      this.canvas.width = width;
+      this.canvas.height = height;
+    }
+    return ratio;
+  }
+
+  /// Redraws everything that is in the viewport.
+  update() {
+    const { scene, zoom, selectedId } = this.renderer;
+    const context = this.context;
+    const ratio = this.resize();
+    context.setTransform(1, 0, 0, 1, 0, 0);
+    context.clearRect(0, 0, this.canvas.width, this.canvas.height);
+    if (!scene) {
+      return;
+    }
+
+    const [tx, ty] = zoom.translate();
+    const scale = zoom.scale();
+    context.setTransform(ratio * scale, 0, 0, ratio * scale, ratio * tx, ratio * ty);
+    const { nodes, edges } = scene.query(this.renderer.getViewportRect());
+
+    // Edges, then arrowheads: one path per selection state.
+    const edgeGroups = groupBy(edges, (item) => {
+      const classes = getEdgeSelectionClasses(item.e, selectedId);
+      return classes.length ? classes[classes.length - 1] : '';
+    });
+    for (const [key, items] of edgeGroups) {
+      const style = CANVAS_EDGE_STYLES[key];
+      context.beginPath();
+      for (const { points } of items) {
+        context.moveTo(points[0].x, points[0].y);
+        for (let i = 1; i < points.length; i++) {
+          context.lineTo(points[i].x, points[i].y);
+        }
+      }
+      context.strokeStyle = style.stroke;
+      context.lineWidth = style.width;
+      context.stroke();
+
+      context.beginPath();
+      for (const { points } of items) {
+        addArrowhead(context, points, style.width);
+      }
+      context.fillStyle = style.arrowhead;
+      context.fill();
+    }
+
+    // Node boxes: one path per node type, then one for all outlines.
+    const nodeGroups = groupBy(nodes, item => item.node.class);
+    for (const [nodeClass, items] of nodeGroups) {
+      context.beginPath();
+      for (const item of items) {
+        context.rect(item.x - item.width / 2, item.y - item.height / 2, item.width, item.height);
+      }
+      context.fillStyle = (CANVAS_NODE_STYLES[nodeClass] || CANVAS_DEFAULT_NODE_STYLE).fill;
+      context.fill();
+    }
+    let selectedNode = null;
+    context.beginPath();
+    for (const item of nodes) {
+      if (item.id === selectedId) {
+        selectedNode = item;
+      } else {
+        context.rect(item.x - item.width / 2, item.y - item.height / 2, item.width, item.height);
+      }
+    }
+    context.strokeStyle = CANVAS_NODE_STROKE.color;
+    context.lineWidth = CANVAS_NODE_STROKE.width;
+    context.stroke();
+    if (selectedNode) {
+      context.strokeStyle = CANVAS_SELECTED_NODE_STROKE.color;
+      context.lineWidth = CANVAS_SELECTED_NODE_STROKE.width;
+      context.strokeRect(selectedNode.x - selectedNode.width / 2, selectedNode.y - selectedNode.height / 2,
+                         selectedNode.width, selectedNode.height);
+    }
+
+    if (scale * LABEL_LINE_HEIGHT < CANVAS_MIN_LABEL_SIZE) {
+      return;
+    }
+
+    // Labels, laid out like dagre-d3 text labels: one line per em, offset by 1 unit.
+    context.font = LABEL_FONT;
+    context.textAlign = 'left';
+    context.textBaseline = 'alphabetic';
+    for (const [nodeClass, items] of nodeGroups) {
+      context.fillStyle = (CANVAS_NODE_STYLES[nodeClass] || CANVAS_DEFAULT_NODE_STYLE).label;
+      for (const item of items) {
+        const x = item.x - item.labelWidth / 2 + 1;
+        const y = item.y - item.labelHeight / 2;
+        item.lines.forEach((line, i) => context.fillText(line, x, y + LABEL_LINE_HEIGHT * (i + 1)));
+      }
+    }
+
+    context.textAlign = 'center';
+    context.textBaseline = 'middle';
+    context.fillStyle = CANVAS_EDGE_LABEL_COLOR;
+    for (const [key, items] of edgeGroups) {
+      context.font = key ? CANVAS_SELECTED_EDGE_LABEL_FONT : LABEL_FONT;
+      for (const item of items) {
+        if (item.labelText) {
+          context.fillText(item.labelText, item.labelX, item.labelY);
+        }
+      }
+    }
+  }
+}
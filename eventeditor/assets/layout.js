@@ -0,0 +1,295 @@
+// Graph layout with a per-component cache.
+//
+// Connected components are laid out separately with dagre and placed side by side. The layout of
+// a component only depends on its structure and on the size of its nodes and edge labels, so it is
+// cached under a hash of those. Components that have not changed since the last layout (or the
+// last session) do not need to be laid out again.
+//
+// Nothing in this file may access the DOM.
+
+// Bump this whenever the layout algorithm or the cached data changes.
+const LAYOUT_VERSION = 1;
+const COMPONENT_SPACING = 50;
+
+/// Fast 53-bit string hash (cyrb53).
+function hashString(str) {
+  let h1 = 0xdeadbeef;
+  let h2 = 0x41c6ce57;
+  for (let i = 0; i < str.length; i++) {
+    const ch = str.charCodeAt(i);
+    h1 = Math.imul(h1 ^ ch, 2654435761);
+    h2 = Math.imul(h2 ^ ch, 1597334677);
+  }
+  h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+  h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+  return 4294967296 * (2097151 & h2) + (h1 >>> 0);
+}
+
+/// Total order for node IDs: numeric IDs (events and entry points) by value, then other IDs
+/// (e.g. collapsed regions: "r12") as strings.
+function compareNodeIds(a, b) {
+  const x = Number(a);
+  const y = Number(b);
+  const xIsNumber = !Number.isNaN(x);
+  const yIsNumber = !Number.isNaN(y);
+  if (xIsNumber && yIsNumber) {
+    return x - y;
+  }
+  if (xIsNumber !== yIsNumber) {
+    return xIsNumber ? -1 : 1;
+  }
+  const sa = String(a);
+  const sb = String(b);
+  return sa < sb ? -1 : (sa > sb ? 1 : 0);
+}
+
+/// Describes a component of g in terms of local node indices, so that the description does not change
+/// when event indices are shifted (e.g. after an event is removed).
+///
+/// The returned object has the cache key, the graph elements in local order (to apply layouts) and the
+/// plain data that layoutComponent needs (which can be sent to a worker).
+function describeComponent(g, nodes) {
+  const sortedNodes = nodes.slice().sort(compareNodeIds);
+  const localIds = new Map(sortedNodes.map((v, i) => [v, i]));
+  const nodeSizes = sortedNodes.map(v => [g.node(v).width, g.node(v).height]);
+  const edges = [];
+  for (const v of sortedNodes) {
+    for (const e of g.outEdges(v)) {
+      const edge = g.edge(e);
+      const localKey = `${localIds.get(e.v)}>${localIds.get(e.w)}:${edge.value}`;
+      edges.push({ e, data: [localIds.get(e.v), localIds.get(e.w), localKey, edge.width, edge.height] });
+    }
+  }
+  edges.sort((a, b) => a.data[2] < b.data[2] ? -1 : (a.data[2] > b.data[2] ? 1 : 0));
+
+  const input = { nodes: nodeSizes, edges: edges.map(edge => edge.data) };
+  const key = hashString(`${LAYOUT_VERSION}|${JSON.stringify(input)}`).toString(36);
+  return { key, nodes: sortedNodes, edges, input };
+}
+
+/// Lays out a single component (see describeComponent).
+/// Coordinates are relative to the top left corner of the component.
+function layoutComponent(input) {
+  const sub = new dagreD3.graphlib.Graph({ multigraph: true });
+  sub.setGraph({});
+  input.nodes.forEach(([width, height], i) => sub.setNode(i, { width, height }));
+  for (const [v, w, localKey, width, height] of input.edges) {
+    sub.setEdge(v, w, { width, height }, localKey);
+  }
+
+  dagreD3.dagre.layout(sub);
+
+  const layout = {
+    width: sub.graph().width,
+    height: sub.graph().height,
+    nodes: input.nodes.map((_, i) => [sub.node(i).x, sub.node(i).y]),
+    edges: {},
+  };
+  for (const e of sub.edges()) {
+    const edge = sub.edge(e);
+    layout.edges[e.name] = [edge.x, edge.y, edge.points.map(p => [p.x, p.y])];
+  }
+  return layout;
+}
+
+/// Component layouts, evicted in least recently used order once they take up more than maxSize bytes
+/// (estimated from their JSON size).
+class LayoutCache {
+  constructor(maxSize = 32 << 20) {
+    this.maxSize = maxSize;
+    // Iterated in least recently used order.
+    this.entries = new Map();
+    this.sizes = new Map();
+    this.size = 0;
+    // Entries that were added and keys that were used since the last call to takeChanges.
+    this.newEntries = {};
+    this.usedKeys = new Set();
+    this.hits = 0;
+    this.misses = 0;
+  }
+
+  /// Loads entries from their JSON representation (see FlowchartWebObject.getLayouts).
+  load(json) {
+    const entries = Object.entries(JSON.parse(json));
+    // Measuring each entry would mean serialising all of them again.
+    const averageSize = entries.length ? json.length / entries.length : 0;
+    for (const [key, layout] of entries) {
+      this.store(key, layout, averageSize);
+    }
+    this.trim();
+  }
+
+  get(key) {
+    const layout = this.entries.get(key);
+    if (layout) {
+      this.hits++;
+      this.entries.delete(key);
+      this.entries.set(key, layout);
+      this.usedKeys.add(key);
+    } else {
+      this.misses++;
+    }
+    return layout;
+  }
+
+  set(key, layout) {
+    this.store(key, layout, key.length + JSON.stringify(layout).length);
+    this.newEntries[key] = layout;
+  }
+
+  store(key, layout, size) {
+    if (this.entries.has(key)) {
+      this.size -= this.sizes.get(key);
+      this.entries.delete(key);
+    }
+    this.entries.set(key, layout);
+    this.sizes.set(key, size);
+    this.size += size;
+  }
+
+  /// Evicts entries until the cache fits in maxSize.
+  /// Must not be called between prepareLayout and applyLayout.
+  trim() {
+    for (const key of this.entries.keys()) {
+      if (this.size <= this.maxSize) {
+        break;
+      }
+      this.size -= this.sizes.get(key);
+      this.entries.delete(key);
+      this.sizes.delete(key);
+    }
+  }
+
+  /// Returns the entries that were added and the keys that were used since the last call.
+  takeChanges() {
+    const changes = { entries: this.newEntries, usedKeys: [...this.usedKeys] };
+    this.newEntries = {};
+    this.usedKeys = new Set();
+    return changes;
+  }
+}
+
+/// Splits g into components and looks up their layouts in the cache.
+/// Components that still need to be laid out are listed in the missing property.
+function prepareLayout(g, cache) {
+  const components = dagreD3.graphlib.alg.components(g).map(nodes => describeComponent(g, nodes));
+  const missing = [];
+  const missingKeys = new Set();
+  for (const component of components) {
+    if (!cache.get(component.key) && !missingKeys.has(component.key)) {
+      missing.push(component);
+      missingKeys.add(component.key);
+    }
+  }
+  return { components, missing };
+}
+
+/// Sets positions for all nodes and edges in g, like dagre.layout.
+/// All component layouts must be in the cache.
+function applyLayout(g, prepared, cache) {
+  let x = 0;
+  let height = 0;
+  for (const component of prepared.components) {
+    const layout = cache.entries.get(component.key);
+    component.nodes.forEach((v, i) => {
+      const node = g.node(v);
+      node.x = layout.nodes[i][0] + x;
+      node.y = layout.nodes[i][1];
+    });
+    for (const { e, data } of component.edges) {
+      const edge = g.edge(e);
+      const [labelX, labelY, points] = layout.edges[data[2]];
+      edge.x = labelX + x;
+      edge.y = labelY;
+      edge.points = points.map(([px, py]) => ({ x: px + x, y: py }));
+    }
+
+    x += layout.width + COMPONENT_SPACING;
+    height = Math.max(height, layout.height);
+  }
+  g.graph().width = Math.max(0, x - COMPONENT_SPACING);
+  g.graph().height = height;
+}
+
+/// Lays out g synchronously. Nodes and edge labels must already have a size.
+function layoutGraph(g, cache) {
+  const prepared = prepareLayout(g, cache);
+  for (const component of prepared.missing) {
+    cache.set(component.key, layoutComponent(component.input));
+  }
+  applyLayout(g, prepared, cache);
+  cache.trim();
+}
+
+/// Runs layoutComponent in a worker. Starting a new job cancels the previous one.
+/// Falls back to laying out on the main thread if workers are unavailable.
+class LayoutWorker {
+  constructor() {
+    this.worker = null;
+    this.job = null;
+    this.nextJobId = 0;
+    this.available = typeof Worker !== 'undefined';
+  }
+
+  /// Returns a promise that resolves with one layout per input, or null if the job was superseded.
+  run(inputs) {
+    this.cancel();
+    if (!inputs.length) {
+      return Promise.resolve([]);
+    }
+    if (!this.available) {
+      return Promise.resolve(inputs.map(layoutComponent));
+    }
+
+    return new Promise((resolve) => {
+      const job = { id: this.nextJobId++, inputs, resolve };
+      this.job = job;
+      try {
+        if (!this.worker) {
+          this.worker = new Worker('layout_worker.js');
+          this.worker.onmessage = (event) => this.onMessage(event.data);
+          this.worker.onerror = (event) => this.onError(event);
+        }
+        this.worker.postMessage({ id: job.id, inputs });
+      } catch (e) {
+        this.onError(e);
+      }
+    });
+  }
+
+  cancel() {
+    if (!this.job) {
+      return;
+    }
+    // dagre cannot be interrupted, so the only way to stop a running layout is to kill the worker.
+    this.job.resolve(null);
+    this.job = null;
+    if (this.worker) {
+      this.worker.terminate();
+      this.worker = null;
+    }
+  }
+
+  onMessage(data) {
+    if (!this.job || data.id !== this.job.id) {
+      return;
+    }
+    const job = this.job;
+    this.job = null;
+    job.resolve(data.layouts);
+  }
+
+  onError(error) {
+    console.warn('Layout worker failed; laying out on the main thread instead', error);
+    this.available = false;
+    if (this.worker) {
+      this.worker.terminate();
+      this.worker = null;
+    }
+    const job = this.job;
+    this.job = null;
+    if (job) {
+      job.resolve(job.inputs.map(layoutComponent));
+    }
+  }
+}
@@ -0,0 +1,10 @@
+// Lays out graph components off the main thread. See LayoutWorker in layout.js.
+
+// The dagre-d3 bundle expects to be loaded in a window.
+self.window = self;
+importScripts('lib/dagre-d3.js', 'layout.js');
+
+onmessage = (event) => {
+  const { id, inputs } = event.data;
+  postMessage({ id, layouts: inputs.map(layoutComponent) });
+};
@@ -4,33 +4,39 @@ let eventNamesVisible = false;
 let eventParamVisible = false;
 let actionsProhibited = false;
 let isDeleting = false;
+// Event to select once it has been sent by the widget (see FlowchartWebObject.isLazy).
+let pendingSelection = null;
 
 const WHITELISTED_PARAMS = new Set(['MessageId', 'ASName']);
 
-function getNodeLabel(node) {
-  const prefix = eventNamesVisible ? `${node.data.name}\n` : '';
-  let label = node.id;
+/// Returns the parts of a node label that do not depend on the label settings: {name, body, params}.
+/// name is null for nodes that never show their name separately.
+function getNodeLabelParts(node) {
+  let name = node.data.name;
+  let body = node.id.toString();
 
   if (node.node_type === 'entry') {
-    label = `${node.data.name}`;
+    name = null;
+    body = node.data.unloaded ? `${node.data.name}\n(not loaded)` : `${node.data.name}`;
   }
   else if (node.node_type === 'action') {
-    label = `${prefix}${node.data.actor}\n${node.data.action}`;
+    body = `${node.data.actor}\n${node.data.action}`;
   }
   else if (node.node_type === 'switch') {
-    label = `${prefix}${node.data.actor}\n${node.data.query}`;
+    body = `${node.data.actor}\n${node.data.query}`;
   }
   else if (node.node_type === 'fork') {
-    label = `${prefix}Fork`;
+    body = 'Fork';
   }
   else if (node.node_type === 'join') {
-    label = `${prefix}Join`;
+    body = 'Join';
   }
   else if (node.node_type === 'sub_flow') {
-    label = `${prefix}${node.data.res_flowchart_name}\n<${node.data.entry_point_name}>`;
+    body = `${node.data.res_flowchart_name}\n<${node.data.entry_point_name}>`;
   }
 
-  if (eventParamVisible && node.data.params) {
+  let params = '';
+  if (node.data.params) {
     let i = 0;
     let hasMore = false;
     for (const [key, value] of Object.entries(node.data.params)) {
@@ -42,19 +48,42 @@ function getNodeLabel(node) {
         hasMore = true;
       } else {
         const valueStr = typeof value === 'number' ? value.toFixed(6).replace(/\.?0*$/, '') : value;
-        label += `\n${key}: ${valueStr}`;
+        params += `\n${key}: ${valueStr}`;
       }
       i++;
     }
     if (hasMore) {
-      label += '\n...';
+      params += '\n...';
     }
   }
-  return label;
+  return { name, body, params };
+}
+
+/// Builds a node label from its parts (see getNodeLabelParts) and the current label settings.
+function getNodeLabel(parts) {
+  const prefix = eventNamesVisible && parts.name != null ? `${parts.name}\n` : '';
+  return `${prefix}${parts.body}${eventParamVisible ? parts.params : ''}`;
+}
+
+function getRegionNodeId(head) {
+  return `r${head}`;
+}
+
+/// Returns the region that a summary node stands for, or null if id is an event or entry point.
+function getRegionHead(id) {
+  return id.startsWith('r') ? id.slice(1) : null;
 }
 
 function handleNodeContextMenu(id) {
   const actions = [];
+  const addAction = (name, fn) => actions.push({ title: name, action: () => { setTimeout(fn, 60) } });
+
+  const head = getRegionHead(id);
+  if (head != null) {
+    addAction('Expand region', () => graph.expandRegion(head));
+    addAction('Expand all regions', () => graph.expandAllRegions());
+    return actions;
+  }
 
   const idx = parseInt(id, 10);
   const node = graph.g.node(id);
@@ -62,8 +91,6 @@ function handleNodeContextMenu(id) {
   const nextNodes = [...(new Set(graph.g.outEdges(id).filter(e => !graph.g.edge(e).virtual).map(e => parseInt(e.w, 10))))];
   const classes = node.class.split(' ');
 
-  const addAction = (name, fn) => actions.push({ title: name, action: () => { setTimeout(fn, 60) } });
-
   if (!actionsProhibited) {
     if (idx >= 0) { // Event actions
       if (!classes.includes('fork') && !classes.includes('join')) {
@@ -115,42 +142,387 @@ function handleNodeContextMenu(id) {
     actions.push({ divider: true });
   }
 
-  if (graph.persistentWhitelist) {
+  if (classes.includes('unloaded')) {
+    addAction('Load events', () => widget.loadEntryPoint(idx));
+    addAction('Load all entry points', () => widget.loadAllEntryPoints());
+  }
+
+  if (graph.connectedFilter) {
     addAction('Show all events', () => graph.renderOnlyConnected());
   } else {
     addAction('Show only connected events', () => graph.renderOnlyConnected(id));
   }
 
+  const region = graph.nodes.get(id).region;
+  if (region != null) {
+    addAction('Collapse region', () => graph.collapseRegion(region.toString()));
+  }
+  if (graph.regions.size) {
+    addAction('Collapse all regions', () => graph.collapseAllRegions());
+  }
+  if (graph.collapsedRegions.size) {
+    addAction('Expand all regions', () => graph.expandAllRegions());
+  }
+
   return actions;
 }
 
+function getEdgeName(entry) {
+  return `edge-${entry.source}-${entry.target}-${entry.data.value}`;
+}
+
+const SVG_NS = 'http://www.w3.org/2000/svg';
+// Items are drawn for everything within this distance (in screen pixels) of the viewport,
+// so that small pans do not need any new elements.
+const VIEWPORT_MARGIN = 300;
+// Clicks during which the pointer moved further than this (in pixels) are pans.
+const MAX_CLICK_DISTANCE = 4;
+const SELECTION_CLASSES = ['selected-in-edge', 'selected-out-edge'];
+
+function createOrSelectGroup(root, name) {
+  const selection = root.select(`g.${name}`);
+  return selection.empty() ? root.append('g').attr('class', name) : selection;
+}
+
+function appendSvgElement(parent, name, attrs = {}) {
+  const element = document.createElementNS(SVG_NS, name);
+  for (const [key, value] of Object.entries(attrs)) {
+    element.setAttribute(key, value);
+  }
+  return parent.appendChild(element);
+}
+
+function getPathData(points) {
+  return 'M' + points.map(p => `${p.x},${p.y}`).join('L');
+}
+
+/// Returns the selection classes for an edge (see SELECTION_CLASSES).
+function getEdgeSelectionClasses(e, selectedId) {
+  const classes = [];
+  if (e.w === selectedId) {
+    classes.push('selected-in-edge');
+  }
+  if (e.v === selectedId) {
+    classes.push('selected-out-edge');
+  }
+  return classes;
+}
+
+/// Draws scenes with SVG elements.
+///
+/// Only the nodes and edges that are in (or close to) the viewport have SVG elements. They are
+/// looked up in the spatial index of the scene whenever the view is panned or zoomed, and elements
+/// that go off-screen are recycled for the ones that come into view.
+class SvgBackend {
+  constructor(renderer) {
+    this.renderer = renderer;
+    const outputGroup = createOrSelectGroup(renderer.svgGroup, 'output');
+    this.edgePathsGroup = createOrSelectGroup(outputGroup, 'edgePaths').node();
+    this.edgeLabelsGroup = createOrSelectGroup(outputGroup, 'edgeLabels').node();
+    this.nodesGroup = createOrSelectGroup(outputGroup, 'nodes').node();
+    this.createMarkers();
+
+    // Materialised elements, keyed by node ID or edge name, and recycled elements.
+    this.nodeElements = new Map();
+    this.edgeElements = new Map();
+    this.nodePool = [];
+    this.edgePool = [];
+  }
+
+  /// Creates arrowheads that are shared by all edges (one per selection state).
+  createMarkers() {
+    const svg = this.renderer.svg.node();
+    const defs = svg.insertBefore(document.createElementNS(SVG_NS, 'defs'), svg.firstChild);
+    for (const suffix of ['', ...SELECTION_CLASSES.map(cl => '-' + cl)]) {
+      const marker = appendSvgElement(defs, 'marker', {
+        id: `arrowhead${suffix}`,
+        viewBox: '0 0 10 10',
+        refX: 9,
+        refY: 5,
+        markerUnits: 'strokeWidth',
+        markerWidth: 8,
+        markerHeight: 6,
+        orient: 'auto',
+      });
+      appendSvgElement(marker, 'path', { d: 'M 0 0 L 10 5 L 0 10 z', style: 'stroke-width: 1; stroke-dasharray: 1,0' });
+    }
+  }
+
+  setScene() {
+    // Everything may have moved or changed, so all elements are filled again.
+    this.clear();
+    this.update();
+  }
+
+  /// Removes all elements.
+  clear() {
+    for (const element of this.nodeElements.values()) {
+      this.recycle(element, this.nodePool);
+    }
+    for (const element of this.edgeElements.values()) {
+      this.recycle(element, this.edgePool);
+    }
+    this.nodeElements.clear();
+    this.edgeElements.clear();
+  }
+
+  /// Creates elements for items that have come into view and recycles the ones that have left it.
+  update() {
+    const { scene } = this.renderer;
+    if (!scene) {
+      return;
+    }
+    const { nodes, edges } = scene.query(this.renderer.getViewportRect(VIEWPORT_MARGIN));
+
+    const visibleNodes = new Set(nodes.map(item => item.id));
+    for (const [id, element] of this.nodeElements) {
+      if (!visibleNodes.has(id)) {
+        this.recycle(element, this.nodePool);
+        this.nodeElements.delete(id);
+      }
+    }
+    const visibleEdges = new Set(edges.map(item => item.e.name));
+    for (const [name, element] of this.edgeElements) {
+      if (!visibleEdges.has(name)) {
+        this.recycle(element, this.edgePool);
+        this.edgeElements.delete(name);
+      }
+    }
+
+    for (const item of nodes) {
+      if (!this.nodeElements.has(item.id)) {
+        const element = this.nodePool.pop() || this.createNodeElement();
+        this.fillNodeElement(element, item);
+        this.nodesGroup.appendChild(element.group);
+        this.nodeElements.set(item.id, element);
+      }
+    }
+    for (const item of edges) {
+      if (!this.edgeElements.has(item.e.name)) {
+        const element = this.edgePool.pop() || this.createEdgeElement();
+        this.fillEdgeElement(element, item);
+        this.edgePathsGroup.appendChild(element.group);
+        this.edgeLabelsGroup.appendChild(element.labelGroup);
+        this.edgeElements.set(item.e.name, element);
+      }
+    }
+  }
+
+  /// Nodes have their own event handlers, so there is nothing to hit test.
+  hitTest() {
+    return null;
+  }
+
+  refreshLabels() {
+    for (const element of this.nodeElements.values()) {
+      this.fillNodeElement(element, element.item);
+    }
+  }
+
+  refreshSelection() {
+    for (const element of this.nodeElements.values()) {
+      this.applyNodeClasses(element);
+    }
+    for (const element of this.edgeElements.values()) {
+      this.applyEdgeClasses(element);
+    }
+  }
+
+  recycle(element, pool) {
+    element.group.remove();
+    if (element.labelGroup) {
+      element.labelGroup.remove();
+    }
+    element.item = null;
+    pool.push(element);
+  }
+
+  createNodeElement() {
+    // Same structure as dagre-d3 nodes, which the style sheet relies on.
+    const group = document.createElementNS(SVG_NS, 'g');
+    const rect = appendSvgElement(group, 'rect', { rx: 0, ry: 0 });
+    const labelGroup = appendSvgElement(appendSvgElement(group, 'g', { 'class': 'label' }), 'g');
+    const text = appendSvgElement(labelGroup, 'text');
+
+    const renderer = this.renderer;
+    d3.select(group)
+      .on('click', (id) => {
+        renderer.onNodeClick(id);
+        d3.event.stopPropagation();
+      })
+      .on('dblclick', (id) => {
+        renderer.onNodeDblclick(id);
+        d3.event.stopPropagation();
+      })
+      .on('contextmenu', renderer.contextMenu);
+
+    return { group, rect, labelGroup, text, lines: null, item: null };
+  }
+
+  fillNodeElement(element, item) {
+    element.item = item;
+    element.group.__data__ = item.id;
+    element.group.setAttribute('id', `n${item.id}`);
+    element.group.setAttribute('transform', `translate(${item.x},${item.y})`);
+    element.rect.setAttribute('x', -item.width / 2);
+    element.rect.setAttribute('y', -item.height / 2);
+    element.rect.setAttribute('width', item.width);
+    element.rect.setAttribute('height', item.height);
+    element.labelGroup.setAttribute('transform', `translate(${-item.labelWidth / 2},${-item.labelHeight / 2})`);
+    // Measured lines are cached per label, so identical labels share the same array.
+    if (element.lines !== item.lines) {
+      element.lines = item.lines;
+      element.text.textContent = '';
+      for (const line of item.lines) {
+        const tspan = appendSvgElement(element.text, 'tspan', { dy: '1em', x: 1 });
+        tspan.setAttributeNS('http://www.w3.org/XML/1998/namespace', 'xml:space', 'preserve');
+        tspan.textContent = line;
+      }
+    }
+    this.applyNodeClasses(element);
+  }
+
+  applyNodeClasses(element) {
+    const item = element.item;
+    element.group.setAttribute('class', `node ${item.node.class}${item.id === this.renderer.selectedId ? ' selected' : ''}`);
+  }
+
+  createEdgeElement() {
+    const group = document.createElementNS(SVG_NS, 'g');
+    const path = appendSvgElement(group, 'path', { 'class': 'path', style: 'fill: none' });
+    const labelGroup = document.createElementNS(SVG_NS, 'g');
+    const label = appendSvgElement(labelGroup, 'text', { 'text-anchor': 'middle', 'dominant-baseline': 'central' });
+    return { group, path, labelGroup, label, item: null };
+  }
+
+  fillEdgeElement(element, item) {
+    element.item = item;
+    element.path.setAttribute('d', getPathData(item.points));
+    if (item.labelText) {
+      element.labelGroup.style.display = '';
+      element.labelGroup.setAttribute('transform', `translate(${item.labelX},${item.labelY})`);
+      element.label.setAttribute('id', `label-${item.e.name}`);
+      element.label.textContent = item.labelText;
+    } else {
+      element.labelGroup.style.display = 'none';
+      element.label.removeAttribute('id');
+    }
+    this.applyEdgeClasses(element);
+  }
+
+  applyEdgeClasses(element) {
+    const { e, edge } = element.item;
+    const classes = getEdgeSelectionClasses(e, this.renderer.selectedId);
+    element.group.setAttribute('class', ['edgePath', edge.class, ...classes].join(' '));
+    element.path.setAttribute('marker-end', `url(#arrowhead${classes.length ? '-' + classes[classes.length - 1] : ''})`);
+    element.labelGroup.setAttribute('class', 'edgeLabel');
+    element.label.setAttribute('class', classes.map(cl => cl + '-label').join(' '));
+  }
+}
+
+/// Lays out and draws graphs, and handles zooming and selection.
+///
+/// Graphs are drawn with SVG (SvgBackend) or, for graphs that have too many nodes for that to be
+/// fast, to a canvas (CanvasBackend; see canvas_backend.js).
 class Renderer {
   constructor() {
     this.svg = d3.select('svg');
     this.svgGroup = d3.select('svg g');
 
-    this.nodeWhitelist = null;
+    // Only nodes for which this returns true are drawn (if set).
+    this.nodeFilter = null;
+    this.layoutCache = new LayoutCache();
+    this.layoutWorker = new LayoutWorker();
+    this.measurer = new LabelMeasurer();
+    this.scene = null;
+    this.selectedId = null;
+    // Sent by the widget (see FlowchartWebObject.getRendererSettings).
+    this.settings = { renderer: 'auto', canvasThreshold: 2000, collapseThreshold: 1000, layoutCacheMaxSize: 32 << 20 };
+
+    this.contextMenu = d3.contextMenu(handleNodeContextMenu);
+    this.svgBackend = new SvgBackend(this);
+    this.canvasBackend = new CanvasBackend(this, document.getElementById('graph-canvas'));
+    this.backend = this.svgBackend;
+    this.viewportUpdatePending = false;
 
     this.zoom = d3.behavior.zoom();
-    this.lastZoomEventStart = null;
     this.svg.call(this.zoom.on('zoom', () => this.updateTransform()));
-    this.svg.call(this.zoom.on('zoomstart', () => this.lastZoomEventStart = new Date()));
+    window.addEventListener('resize', () => this.scheduleViewportUpdate());
+
+    // Canvas nodes are not elements, so events for them are dispatched from the SVG element
+    // (which is on top of the canvas). A double click on a node must not zoom in.
+    const zoomOnDblclick = this.svg.on('dblclick.zoom');
+    const renderer = this;
+    this.svg.on('dblclick.zoom', function() {
+      const id = renderer.backend.hitTest(d3.mouse(this));
+      if (id != null) {
+        renderer.onNodeDblclick(id);
+        return;
+      }
+      zoomOnDblclick.apply(this, arguments);
+    });
+    this.svg.on('contextmenu', function() {
+      const id = renderer.backend.hitTest(d3.mouse(this));
+      if (id != null) {
+        renderer.contextMenu.call(this, id, 0);
+      }
+    });
 
     // Reset selection on click.
-    // Unfortunately we need to do some extra work to determine whether the click event is caused
-    // by zooming or is a simple click.
-    this.svg.on('click', () => {
-      // The zoom lasted more than 100 ms, so it's likely a zoom.
-      if ((new Date() - this.lastZoomEventStart) >= 100) {
+    // Unfortunately we need to do some extra work to determine whether the click event ends a pan
+    // or is a simple click. This depends on how far the pointer moved, not on how long the button
+    // was held, so that slow clicks on nodes still work.
+    let mouseDownPosition = null;
+    this.svg.on('mousedown.click', function() {
+      mouseDownPosition = d3.mouse(this);
+    });
+    this.svg.on('click', function() {
+      const position = d3.mouse(this);
+      if (mouseDownPosition && Math.hypot(position[0] - mouseDownPosition[0], position[1] - mouseDownPosition[1]) > MAX_CLICK_DISTANCE) {
+        return;
+      }
+      const id = renderer.backend.hitTest(position);
+      if (id != null) {
+        renderer.onNodeClick(id);
         return;
       }
-      this.clearSelection();
+      renderer.clearSelection();
     });
   }
 
+  onNodeClick(id) {
+    const head = getRegionHead(id);
+    if (head != null) {
+      graph.expandRegion(head);
+      return;
+    }
+    if (graph.g.node(id).class.split(' ').includes('unloaded')) {
+      widget.loadEntryPoint(parseInt(id, 10));
+    }
+    this.select(id);
+  }
+
+  onNodeDblclick(id) {
+    const head = getRegionHead(id);
+    if (head != null) {
+      graph.expandRegion(head);
+      return;
+    }
+    if (actionsProhibited) {
+      return;
+    }
+
+    const node = graph.g.node(id);
+    const classes = node.class.split(' ');
+    if (classes.includes('fork')) {
+      widget.editForkBranches(parseInt(id, 10));
+    } else {
+      widget.editEvent(parseInt(id, 10));
+    }
+  }
+
   getSelection() {
-    const selected = d3.select('.selected');
-    return selected.empty() ? -1 : parseInt(selected.attr('id').slice(1), 10);
+    return this.selectedId == null ? -1 : parseInt(this.selectedId, 10);
   }
 
   clearSelection() {
@@ -159,91 +531,136 @@ class Renderer {
   }
 
   clearSelectionWithoutEmittingSignal() {
-    const selected = this.getSelection();
-    if (selected !== -1) {
-      const node = graph.g.node(selected);
-      node.class = node.class.replace(/\bselected\b/, '');
-    }
-    for (const cl of ['selected', 'selected-in-edge', 'selected-out-edge', 'selected-in-edge-label', 'selected-out-edge-label']) {
-      d3.selectAll('.' + cl).classed(cl, false);
-    }
+    this.selectedId = null;
+    this.backend.refreshSelection();
   }
 
-  select(id, g) {
-    this.clearSelectionWithoutEmittingSignal();
-    d3.select(`#n${id}`).classed('selected', true);
-    g.node(id).class += ' selected';
-    g.inEdges(id).forEach((e) => {
-      d3.selectAll(`.edge-${e.v}-${e.w}`).classed('selected-in-edge', true);
-      d3.select(`#label-${e.name}`).classed('selected-in-edge-label', true);
-    });
-    g.outEdges(id).forEach((e) => {
-      d3.selectAll(`.edge-${e.v}-${e.w}`).classed('selected-out-edge', true);
-      d3.select(`#label-${e.name}`).classed('selected-out-edge-label', true);
-    });
+  select(id) {
+    this.selectedId = id.toString();
+    this.backend.refreshSelection();
     widget.emitEventSelectedSignal(parseInt(id, 10));
   }
 
-  getElement(id) {
-    const element = d3.select(`#n${id}`);
-    return element.empty() ? null : element;
-  }
-
   scrollTo(id, center=false, duration=1000) {
-    const element = this.getElement(id);
-    if (!element) {
+    const item = this.scene && this.scene.nodes.get(id.toString());
+    if (!item) {
       return false;
     }
-    const t = d3.transform(element.attr('transform'));
-    const [x, y] = t.translate;
     const scale = this.zoom.scale();
-    const newY = y*-scale + (center ? (window.innerHeight/2) : 60);
+    const newY = item.y*-scale + (center ? (window.innerHeight/2) : 60);
     this.svg.transition().duration(duration)
-      .call(this.zoom.translate([x*-scale + window.innerWidth/2, newY]).event);
+      .call(this.zoom.translate([item.x*-scale + window.innerWidth/2, newY]).event);
     return true;
   }
 
+  /// Returns the backend that should be used to draw a graph with the specified number of nodes.
+  chooseBackend(numNodes) {
+    const { renderer, canvasThreshold } = this.settings;
+    if (renderer === 'canvas' || (renderer !== 'svg' && numNodes >= canvasThreshold)) {
+      return this.canvasBackend;
+    }
+    return this.svgBackend;
+  }
+
   render(g) {
     const visibleGraph = new graphlib.Graph({ multigraph: true });
     visibleGraph.setGraph({});
-    visibleGraph.graph().transition = (selection) => {
-      return selection.transition().duration(500);
-    };
 
     for (const v of g.nodes()) {
-      if (!this.nodeWhitelist || this.nodeWhitelist.has(v)) {
+      if (!this.nodeFilter || this.nodeFilter(v)) {
         visibleGraph.setNode(v, g.node(v));
       }
     }
     for (const e of g.edges()) {
-      if (!this.nodeWhitelist || this.nodeWhitelist.has(e.v)) {
+      if (!this.nodeFilter || this.nodeFilter(e.v)) {
         visibleGraph.setEdge(e, g.edge(e));
       }
     }
 
-    const render = dagreD3.render();
-    this.svgGroup.call(render, visibleGraph);
-    this.svgGroup.selectAll('.node')
-      .on('click', (id) => {
-        this.select(id, g);
-        d3.event.stopPropagation();
-      })
-      .on('dblclick', (id) => {
-        if (actionsProhibited) {
-          d3.event.stopPropagation();
-          return;
-        }
+    measureGraph(visibleGraph, this.measurer);
 
-        const node = g.node(id);
-        const classes = node.class.split(' ');
-        if (classes.includes('fork')) {
-          widget.editForkBranches(parseInt(id, 10));
-        } else {
-          widget.editEvent(parseInt(id, 10));
-        }
-        d3.event.stopPropagation();
-      })
-      .on('contextmenu', d3.contextMenu(handleNodeContextMenu));
+    // Layout is done in a worker to keep the view responsive. Only components that are not
+    // in the cache are sent to it. A newer render cancels any layout that is still running.
+    const prepared = prepareLayout(visibleGraph, this.layoutCache);
+    return this.layoutWorker.run(prepared.missing.map(component => component.input)).then((layouts) => {
+      if (!layouts) {
+        return false;
+      }
+      prepared.missing.forEach((component, i) => this.layoutCache.set(component.key, layouts[i]));
+      applyLayout(visibleGraph, prepared, this.layoutCache);
+      this.setScene(new Scene(visibleGraph, this.measurer));
+
+      this.layoutCache.trim();
+
+      const changes = this.layoutCache.takeChanges();
+      if (Object.keys(changes.entries).length || changes.usedKeys.length) {
+        widget.storeLayouts(JSON.stringify(changes.entries), JSON.stringify(changes.usedKeys));
+      }
+      return true;
+    });
+  }
+
+  /// Changes the labels of the current scene without laying it out again.
+  /// Returns false (and changes nothing) if that is not possible because the size of a node would change.
+  updateLabels(getLabel) {
+    // A layout that is still running was started with the old labels, so it has to be restarted.
+    if (!this.scene || this.layoutWorker.job) {
+      return false;
+    }
+    const changes = [];
+    for (const item of this.scene.nodes.values()) {
+      const label = getLabel(item.id);
+      const [lines, labelWidth, labelHeight] = this.measurer.measure(label);
+      // Measurements are cached per label, so an unchanged label has the same lines.
+      if (lines === item.lines) {
+        continue;
+      }
+      if (labelWidth + 2 * NODE_PADDING !== item.width || labelHeight + 2 * NODE_PADDING !== item.height) {
+        return false;
+      }
+      changes.push([item, label, lines, labelWidth, labelHeight]);
+    }
+    for (const [item, label, lines, labelWidth, labelHeight] of changes) {
+      item.node.label = label;
+      Object.assign(item, { lines, labelWidth, labelHeight });
+    }
+    if (changes.length) {
+      this.backend.refreshLabels();
+    }
+    return true;
+  }
+
+  setScene(scene) {
+    this.scene = scene;
+    const backend = this.chooseBackend(scene.nodes.size);
+    if (backend !== this.backend) {
+      this.backend.clear();
+      this.backend = backend;
+    }
+    this.backend.setScene();
+  }
+
+  /// Returns the part of the graph that is visible (plus a margin in screen pixels), in graph coordinates.
+  getViewportRect(margin = 0) {
+    const [tx, ty] = this.zoom.translate();
+    const scale = this.zoom.scale();
+    return [
+      (-margin - tx) / scale,
+      (-margin - ty) / scale,
+      (window.innerWidth + margin - tx) / scale,
+      (window.innerHeight + margin - ty) / scale,
+    ];
+  }
+
+  scheduleViewportUpdate() {
+    if (this.viewportUpdatePending) {
+      return;
+    }
+    this.viewportUpdatePending = true;
+    window.requestAnimationFrame(() => {
+      this.viewportUpdatePending = false;
+      this.backend.update();
+    });
   }
 
   setScale(scale) { this.zoom.scale(scale); this.updateTransform(); }
@@ -251,81 +668,274 @@ class Renderer {
 
   updateTransform() {
     this.svgGroup.attr('transform', `translate(${this.zoom.translate()})scale(${this.zoom.scale()})`);
+    this.scheduleViewportUpdate();
   }
 }
 
 class Graph {
   constructor() {
     this.g = null;
-    this.data = null;
+    // Node ID -> node entry, as sent by the widget. Used to regenerate labels.
+    this.nodes = new Map();
+    // Revision of the graph data; -1 if no data has been received yet.
+    this.revision = -1;
+    // Region ID (= ID of its first node) -> {kind, parent, size}. See flowchart_graph.add_regions.
+    this.regions = new Map();
+    // Collapsed regions are drawn as a single node (only the outermost one if they are nested).
+    this.collapsedRegions = new Set();
+    // Node key (see getNodeKey) -> node ID.
+    this.idsByKey = new Map();
     this.renderer = new Renderer();
-    this.persistentWhitelist = null;
+    // If set, only the connected component that contains this node is drawn: {key, component}.
+    // The node is identified by its key, because event indices change when events are removed.
+    this.connectedFilter = null;
   }
 
-  update(data) {
-    this.data = data;
-    this.g = new graphlib.Graph({ multigraph: true });
-    this.g.setGraph({});
+  /// Applies a batch of changes from widget.getGraphUpdate.
+  update(diff) {
+    const full = diff.full || !this.g;
+    if (full) {
+      this.g = new graphlib.Graph({ multigraph: true });
+      this.g.setGraph({});
+      this.nodes.clear();
+      this.idsByKey.clear();
+      this.regions.clear();
+    }
 
-    for (const entry of data) {
+    for (const entry of diff.removed) {
       if (entry.type === 'node') {
-        this.g.setNode(entry.id, {
-          label: getNodeLabel(entry),
-          'class': entry.node_type,
-          id: `n${entry.id}`,
-          idx: entry.id,
-          name: entry.data.name,
-        });
+        this.g.removeNode(entry.id);
+        this.deleteNodeEntry(entry.id.toString());
       } else if (entry.type === 'edge') {
-        this.g.setEdge(entry.source, entry.target, {
-          labelType: 'html',
-          label: `<span id="label-edge-${entry.source}-${entry.target}-${entry.data.value}">${entry.data.value == null ? '' : entry.data.value}</span>`,
-          'class': `edge-${entry.source}-${entry.target}`,
-          virtual: !!entry.data.virtual,
-        }, `edge-${entry.source}-${entry.target}-${entry.data.value}`);
+        this.g.removeEdge(entry.source, entry.target, getEdgeName(entry));
+      } else if (entry.type === 'region') {
+        this.regions.delete(entry.id.toString());
+        this.collapsedRegions.delete(entry.id.toString());
+      }
+    }
+
+    const selected = this.renderer.selectedId;
+    if (selected != null && !this.g.hasNode(selected)) {
+      this.renderer.clearSelectionWithoutEmittingSignal();
+    }
+
+    // Nodes must be set first: setting an edge implicitly creates missing nodes.
+    for (const entries of [diff.added, diff.updated]) {
+      for (const entry of entries) {
+        if (entry.type === 'node') {
+          this.setNode(entry);
+        }
       }
     }
+    for (const entries of [diff.added, diff.updated]) {
+      for (const entry of entries) {
+        if (entry.type === 'edge') {
+          this.setEdge(entry);
+        } else if (entry.type === 'region') {
+          this.regions.set(entry.id.toString(), {
+            kind: entry.kind,
+            parent: entry.parent == null ? null : entry.parent.toString(),
+            size: entry.size,
+          });
+        }
+      }
+    }
+
+    // Large flows start with everything collapsed, so that only the outermost regions are laid out.
+    if (full) {
+      this.collapsedRegions = this.nodes.size >= this.renderer.settings.collapseThreshold
+        ? new Set(this.regions.keys()) : new Set();
+    }
+
+    this.revision = diff.revision;
+  }
+
+  getNodeKey(entry) {
+    return `${entry.node_type === 'entry' ? 'entry' : 'event'}:${entry.data.name}`;
   }
 
+  deleteNodeEntry(id) {
+    const entry = this.nodes.get(id);
+    if (entry && this.idsByKey.get(this.getNodeKey(entry)) === id) {
+      this.idsByKey.delete(this.getNodeKey(entry));
+    }
+    this.nodes.delete(id);
+  }
+
+  setNode(entry) {
+    this.deleteNodeEntry(entry.id.toString());
+    this.nodes.set(entry.id.toString(), entry);
+    this.idsByKey.set(this.getNodeKey(entry), entry.id.toString());
+    const labelParts = getNodeLabelParts(entry);
+    this.g.setNode(entry.id, {
+      label: getNodeLabel(labelParts),
+      labelParts,
+      'class': entry.data.unloaded ? `${entry.node_type} unloaded` : entry.node_type,
+      id: `n${entry.id}`,
+      idx: entry.id,
+      name: entry.data.name,
+    });
+  }
+
+  setEdge(entry) {
+    const name = getEdgeName(entry);
+    this.g.setEdge(entry.source, entry.target, {
+      labelType: 'html',
+      label: `<span id="label-${name}">${entry.data.value == null ? '' : entry.data.value}</span>`,
+      'class': `edge-${entry.source}-${entry.target}`,
+      virtual: !!entry.data.virtual,
+      value: entry.data.value,
+    }, name);
+  }
+
+  getRegionLabel(head) {
+    return `${getNodeLabel(this.g.node(head).labelParts)}\n[${this.regions.get(head).size - 1} more events]`;
+  }
+
+  /// Regenerates node labels (e.g. after label settings have changed).
+  /// The graph is only laid out again if the size of a node has changed.
   refresh() {
-    if (this.data && Object.keys(this.data).length > 0) {
-      this.update(this.data);
+    if (!this.g) {
+      return Promise.resolve(false);
+    }
+    for (const v of this.g.nodes()) {
+      const node = this.g.node(v);
+      node.label = getNodeLabel(node.labelParts);
     }
+    const updated = this.renderer.updateLabels((v) => {
+      const head = getRegionHead(v);
+      return head != null ? this.getRegionLabel(head) : this.g.node(v).label;
+    });
+    return updated ? Promise.resolve(true) : this.render();
   }
 
-  render() {
-    if (this.persistentWhitelist) {
-      this.renderer.nodeWhitelist = new Set(this.g.nodes()
-        .map(idx => this.g.node(idx))
-        .filter(node => this.persistentWhitelist.has(node.name))
-        .map(node => node.idx.toString())
-      );
-    } else {
-      this.renderer.nodeWhitelist = null;
+  /// Returns the outermost collapsed region that contains v, or null.
+  getCollapsedRegion(v) {
+    const entry = this.nodes.get(v);
+    let result = null;
+    for (let head = entry && entry.region != null ? entry.region.toString() : null; head != null; head = this.regions.get(head).parent) {
+      if (this.collapsedRegions.has(head)) {
+        result = head;
+      }
+    }
+    return result;
+  }
+
+  /// Returns the graph that should be drawn: collapsed regions are replaced with a summary node
+  /// that has the edges of the region to the rest of the graph.
+  getDisplayGraph() {
+    if (!this.collapsedRegions.size) {
+      return this.g;
     }
 
-    this.renderer.render(this.g);
+    const displayGraph = new graphlib.Graph({ multigraph: true });
+    displayGraph.setGraph({});
+    const mappedNodes = new Map();
+    for (const v of this.g.nodes()) {
+      const head = this.getCollapsedRegion(v);
+      if (head == null) {
+        mappedNodes.set(v, v);
+        displayGraph.setNode(v, this.g.node(v));
+        continue;
+      }
+      const id = getRegionNodeId(head);
+      mappedNodes.set(v, id);
+      if (!displayGraph.hasNode(id)) {
+        const entry = this.nodes.get(head);
+        displayGraph.setNode(id, {
+          label: this.getRegionLabel(head),
+          'class': 'region',
+          id: `n${id}`,
+          name: entry.data.name,
+        });
+      }
+    }
+
+    for (const e of this.g.edges()) {
+      const v = mappedNodes.get(e.v);
+      const w = mappedNodes.get(e.w);
+      const edge = this.g.edge(e);
+      if (v === e.v && w === e.w) {
+        displayGraph.setEdge(e, edge);
+      } else if (v !== w) {
+        const name = `edge-${v}-${w}-${edge.value}`;
+        if (!displayGraph.hasEdge(v, w, name)) {
+          displayGraph.setEdge(v, w, { 'class': `edge-${v}-${w}`, virtual: edge.virtual, value: edge.value }, name);
+        }
+      }
+    }
+    return displayGraph;
   }
 
-  renderOnlyConnected(v) {
-    const selected = this.renderer.getSelection();
-    this.persistentWhitelist = this.findNodeComponent(v);
-    this.render();
-    if (v != null) {
-      setTimeout(() => this.renderer.scrollTo(v), 500);
-    } else if (selected !== -1) {
-      setTimeout(() => this.renderer.scrollTo(selected), 500);
+  collapseRegion(head) {
+    this.collapsedRegions.add(head);
+    return this.render();
+  }
+
+  expandRegion(head) {
+    this.collapsedRegions.delete(head);
+    return this.render();
+  }
+
+  collapseAllRegions() {
+    this.collapsedRegions = new Set(this.regions.keys());
+    return this.render();
+  }
+
+  expandAllRegions() {
+    this.collapsedRegions.clear();
+    return this.render();
+  }
+
+  /// Expands all regions that contain v. Returns whether anything has changed.
+  expandRegionsContaining(v) {
+    let changed = false;
+    for (let head = this.getCollapsedRegion(v); head != null; head = this.getCollapsedRegion(v)) {
+      this.collapsedRegions.delete(head);
+      changed = true;
     }
+    return changed;
   }
 
-  /// Returns a set of connected events: {"Event123", "Event125", "EntryPoint", ...}
-  findNodeComponent(v) {
-    const components = graphlib.alg.components(this.g);
-    const c = components.find((component) => component.includes(v));
-    if (!c) {
-      return null;
+  /// Returns the connected component of a node (or of the first node of a collapsed region).
+  /// Components are computed by the widget (see flowchart_graph.add_components).
+  getComponent(v) {
+    const head = getRegionHead(v);
+    const entry = this.nodes.get(head != null ? head : v);
+    return entry ? entry.component : null;
+  }
+
+  render() {
+    const displayGraph = this.getDisplayGraph();
+    if (this.connectedFilter) {
+      // Keep the last known component if the node has been removed.
+      const id = this.idsByKey.get(this.connectedFilter.key);
+      if (id != null) {
+        this.connectedFilter.component = this.getComponent(id);
+      }
+      const component = this.connectedFilter.component;
+      this.renderer.nodeFilter = v => this.getComponent(v) === component;
+    } else {
+      this.renderer.nodeFilter = null;
     }
-    return new Set(c.map(idx => this.g.node(idx).name));
+
+    return this.renderer.render(displayGraph);
+  }
+
+  renderOnlyConnected(v) {
+    const selected = this.renderer.getSelection();
+    const entry = v != null ? this.nodes.get(v) : null;
+    this.connectedFilter = entry ? { key: this.getNodeKey(entry), component: entry.component } : null;
+    return this.render().then((rendered) => {
+      if (!rendered) {
+        return;
+      }
+      if (v != null) {
+        setTimeout(() => this.renderer.scrollTo(v), 500);
+      } else if (selected !== -1) {
+        setTimeout(() => this.renderer.scrollTo(selected), 500);
+      }
+    });
   }
 }
 
@@ -378,7 +988,7 @@ document.body.addEventListener('keydown', (event) => {
     const nodes = key === 'ArrowUp' ? graph.g.predecessors(selected) : graph.g.successors(selected);
     if (nodes.length > 0) {
       graph.renderer.scrollTo(nodes[0], true, 500);
-      graph.renderer.select(nodes[0], graph.g);
+      graph.renderer.select(nodes[0]);
     }
   }
 });
@@ -387,32 +997,74 @@ new QWebChannel(qt.webChannelTransport, (channel) => {
   widget = channel.objects.widget;
 
   function select(id) {
-    if (graph.persistentWhitelist) {
+    // The widget is about to send the event.
+    if (graph.g && !graph.g.hasNode(id.toString())) {
+      pendingSelection = id;
+      return;
+    }
+    // The event must be visible, so expand any region that hides it.
+    if (graph.g && graph.expandRegionsContaining(id.toString())) {
+      graph.render().then(() => select(id));
+      return;
+    }
+    if (graph.connectedFilter) {
       graph.renderOnlyConnected(id.toString());
-      graph.renderer.select(id, graph.g);
+      graph.renderer.select(id);
     } else {
       graph.renderer.setScale(1);
-      graph.renderer.select(id, graph.g);
+      graph.renderer.select(id);
       graph.renderer.scrollTo(id);
     }
   }
 
+  // Only one update is requested at a time: a request that is made while another one is in flight
+  // would be based on a stale revision, which makes the widget send the whole graph again.
+  // Instead, the latest request is remembered and made once the current one has been answered.
+  let loadInFlight = false;
+  let queuedLoad = null;
+
   function load(cb) {
-    widget.getJson((data) => {
-      if (!data) {
+    if (loadInFlight) {
+      queuedLoad = { cb };
+      return;
+    }
+    loadInFlight = true;
+    widget.getGraphUpdate(graph.revision, (json) => {
+      loadInFlight = false;
+      if (queuedLoad) {
+        // This update is already outdated, but it must still be applied: the next one is based on it.
+        const next = queuedLoad;
+        queuedLoad = null;
+        if (json) {
+          graph.update(JSON.parse(json));
+        }
+        load(next.cb);
         return;
       }
-      graph.update(data);
-      graph.render();
-      const selected = graph.renderer.getSelection();
-      if (selected !== -1 && !isDeleting) {
-        graph.renderer.scrollTo(selected);
-      }
-      widget.emitReloadedSignal();
-      if (cb) {
-        cb(data);
+      if (!json) {
+        return;
       }
-      isDeleting = false;
+      const diff = JSON.parse(json);
+      graph.update(diff);
+      graph.render().then((rendered) => {
+        // A newer update has superseded this one.
+        if (!rendered) {
+          return;
+        }
+        const selected = graph.renderer.getSelection();
+        if (selected !== -1 && !isDeleting) {
+          graph.renderer.scrollTo(selected);
+        }
+        widget.emitReloadedSignal();
+        if (cb) {
+          cb(diff);
+        }
+        isDeleting = false;
+        if (pendingSelection != null && graph.g.hasNode(pendingSelection.toString())) {
+          select(pendingSelection);
+        }
+        pendingSelection = null;
+      });
     });
   }
 
@@ -425,7 +1077,7 @@ new QWebChannel(qt.webChannelTransport, (channel) => {
   });
 
   widget.fileLoaded.connect(() => {
-    graph.persistentWhitelist = null;
+    graph.connectedFilter = null;
     graph.renderer.clearSelection();
   });
 
@@ -441,7 +1093,6 @@ new QWebChannel(qt.webChannelTransport, (channel) => {
     }
     if (visible !== previousValue) {
       graph.refresh();
-      graph.render();
     }
   });
 
@@ -453,7 +1104,6 @@ new QWebChannel(qt.webChannelTransport, (channel) => {
     }
     if (visible !== previousValue) {
       graph.refresh();
-      graph.render();
     }
   });
 
@@ -462,5 +1112,12 @@ new QWebChannel(qt.webChannelTransport, (channel) => {
   });
 
   widget.emitReadySignal();
-  load();
+  widget.getRendererSettings((json) => {
+    graph.renderer.settings = JSON.parse(json);
+    graph.renderer.layoutCache.maxSize = graph.renderer.settings.layoutCacheMaxSize;
+    widget.getLayouts((json) => {
+      graph.renderer.layoutCache.load(json);
+      load();
+    });
+  });
 });
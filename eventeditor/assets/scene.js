@@ -0,0 +1,248 @@
+// Laid-out graph geometry and the helpers that are needed to build it without creating DOM elements.
+
+const LABEL_FONT = '300 14px "Helvetica Neue", Helvetica, Arial, sans-serif';
+const LABEL_LINE_HEIGHT = 14;
+const NODE_PADDING = 10;
+
+/// Same as dagre-d3's text label escape processing ("\n" -> newline, "\x" -> "x").
+function processEscapeSequences(text) {
+  let newText = '';
+  let escaped = false;
+  for (const ch of text) {
+    if (escaped) {
+      newText += ch === 'n' ? '\n' : ch;
+      escaped = false;
+    } else if (ch === '\\') {
+      escaped = true;
+    } else {
+      newText += ch;
+    }
+  }
+  return newText;
+}
+
+/// Measures text labels with a canvas, which is much cheaper than creating SVG elements and calling getBBox.
+class LabelMeasurer {
+  constructor() {
+    this.context = document.createElement('canvas').getContext('2d');
+    this.context.font = LABEL_FONT;
+    this.cache = new Map();
+  }
+
+  /// Returns [lines, width, height].
+  measure(label) {
+    let result = this.cache.get(label);
+    if (!result) {
+      const lines = processEscapeSequences(label).split('\n');
+      // Lines are offset by 1 unit, like dagre-d3 text labels.
+      const width = Math.max(...lines.map(line => this.context.measureText(line).width)) + 1;
+      // Each line is 1em below the previous one; the extra space is for descenders.
+      const height = lines.length * LABEL_LINE_HEIGHT + 3;
+      result = [lines, width, height];
+      this.cache.set(label, result);
+    }
+    return result;
+  }
+}
+
+function rectsIntersect(a, b) {
+  return a[0] <= b[2] && b[0] <= a[2] && a[1] <= b[3] && b[1] <= a[3];
+}
+
+function rectContains(a, b) {
+  return a[0] <= b[0] && a[1] <= b[1] && b[2] <= a[2] && b[3] <= a[3];
+}
+
+/// Region quadtree for items with a bounding box ([x0, y0, x1, y1]).
+/// Items are stored in the smallest quad that fully contains them.
+class Quadtree {
+  constructor(bounds, depth = 0) {
+    this.bounds = bounds;
+    this.depth = depth;
+    this.items = [];
+    this.children = null;
+  }
+
+  insert(item) {
+    if (!this.children && this.items.length >= Quadtree.CAPACITY && this.depth < Quadtree.MAX_DEPTH) {
+      this.split();
+    }
+    if (this.children) {
+      const child = this.children.find(c => rectContains(c.bounds, item.bbox));
+      if (child) {
+        child.insert(item);
+        return;
+      }
+    }
+    this.items.push(item);
+  }
+
+  split() {
+    const [x0, y0, x1, y1] = this.bounds;
+    const mx = (x0 + x1) / 2;
+    const my = (y0 + y1) / 2;
+    this.children = [
+      [x0, y0, mx, my], [mx, y0, x1, my], [x0, my, mx, y1], [mx, my, x1, y1],
+    ].map(bounds => new Quadtree(bounds, this.depth + 1));
+    const items = this.items;
+    this.items = [];
+    for (const item of items) {
+      this.insert(item);
+    }
+  }
+
+  /// Calls fn for every item whose bounding box intersects rect.
+  query(rect, fn) {
+    if (!rectsIntersect(this.bounds, rect)) {
+      return;
+    }
+    for (const item of this.items) {
+      if (rectsIntersect(item.bbox, rect)) {
+        fn(item);
+      }
+    }
+    if (this.children) {
+      for (const child of this.children) {
+        child.query(rect, fn);
+      }
+    }
+  }
+}
+Quadtree.CAPACITY = 16;
+Quadtree.MAX_DEPTH = 12;
+
+/// Same as dagre-d3's rect intersection.
+function intersectRect(node, point) {
+  const dx = point.x - node.x;
+  const dy = point.y - node.y;
+  let w = node.width / 2;
+  let h = node.height / 2;
+  if (Math.abs(dy) * w > Math.abs(dx) * h) {
+    if (dy < 0) {
+      h = -h;
+    }
+    return { x: node.x + (dy === 0 ? 0 : h * dx / dy), y: node.y + h };
+  }
+  if (dx < 0) {
+    w = -w;
+  }
+  return { x: node.x + w, y: node.y + (dx === 0 ? 0 : w * dy / dx) };
+}
+
+/// Geometry of a laid-out graph, with a spatial index.
+class Scene {
+  constructor(g, measurer) {
+    this.nodes = new Map();
+    this.edges = [];
+    const bounds = [Infinity, Infinity, -Infinity, -Infinity];
+    const extend = (bbox) => {
+      bounds[0] = Math.min(bounds[0], bbox[0]);
+      bounds[1] = Math.min(bounds[1], bbox[1]);
+      bounds[2] = Math.max(bounds[2], bbox[2]);
+      bounds[3] = Math.max(bounds[3], bbox[3]);
+    };
+
+    for (const v of g.nodes()) {
+      const node = g.node(v);
+      const [lines, labelWidth, labelHeight] = measurer.measure(node.label);
+      const item = {
+        type: 'node',
+        id: v,
+        node,
+        lines,
+        labelWidth,
+        labelHeight,
+        x: node.x,
+        y: node.y,
+        width: node.width,
+        height: node.height,
+        bbox: [node.x - node.width / 2, node.y - node.height / 2, node.x + node.width / 2, node.y + node.height / 2],
+      };
+      this.nodes.set(v, item);
+      extend(item.bbox);
+    }
+
+    for (const e of g.edges()) {
+      const edge = g.edge(e);
+      const tail = this.nodes.get(e.v);
+      const head = this.nodes.get(e.w);
+      if (!tail || !head || !edge.points) {
+        continue;
+      }
+      const points = edge.points.slice(1, edge.points.length - 1);
+      points.unshift(intersectRect(tail, points[0] || head));
+      points.push(intersectRect(head, points[points.length - 1]));
+
+      const bbox = [Infinity, Infinity, -Infinity, -Infinity];
+      for (const p of points) {
+        bbox[0] = Math.min(bbox[0], p.x);
+        bbox[1] = Math.min(bbox[1], p.y);
+        bbox[2] = Math.max(bbox[2], p.x);
+        bbox[3] = Math.max(bbox[3], p.y);
+      }
+      const item = { type: 'edge', e, edge, points, bbox, labelText: edge.value == null ? '' : String(edge.value) };
+      if (item.labelText) {
+        item.labelX = edge.x;
+        item.labelY = edge.y;
+        bbox[0] = Math.min(bbox[0], edge.x - edge.width / 2);
+        bbox[1] = Math.min(bbox[1], edge.y - edge.height / 2);
+        bbox[2] = Math.max(bbox[2], edge.x + edge.width / 2);
+        bbox[3] = Math.max(bbox[3], edge.y + edge.height / 2);
+      }
+      this.edges.push(item);
+      extend(bbox);
+    }
+
+    if (bounds[0] > bounds[2]) {
+      bounds.splice(0, 4, 0, 0, 0, 0);
+    }
+    this.bounds = bounds;
+    this.index = new Quadtree(bounds);
+    for (const item of this.nodes.values()) {
+      this.index.insert(item);
+    }
+    for (const item of this.edges) {
+      this.index.insert(item);
+    }
+  }
+
+  /// Returns the nodes and edges that intersect rect.
+  query(rect) {
+    const nodes = [];
+    const edges = [];
+    this.index.query(rect, item => (item.type === 'node' ? nodes : edges).push(item));
+    return { nodes, edges };
+  }
+
+  /// Returns the topmost node at (x, y), or null.
+  hitTest(x, y) {
+    let hit = null;
+    this.index.query([x, y, x, y], (item) => {
+      if (item.type === 'node') {
+        hit = item;
+      }
+    });
+    return hit;
+  }
+}
+
+/// Sets sizes for all nodes and edge labels in g, which is what dagre needs to lay it out.
+function measureGraph(g, measurer) {
+  for (const v of g.nodes()) {
+    const node = g.node(v);
+    const [, labelWidth, labelHeight] = measurer.measure(node.label);
+    node.width = labelWidth + 2 * NODE_PADDING;
+    node.height = labelHeight + 2 * NODE_PADDING;
+  }
+  for (const e of g.edges()) {
+    const edge = g.edge(e);
+    if (edge.value == null || edge.value === '') {
+      edge.width = 0;
+      edge.height = 0;
+    } else {
+      const [, labelWidth, labelHeight] = measurer.measure(String(edge.value));
+      edge.width = labelWidth;
+      edge.height = labelHeight;
+    }
+  }
+}
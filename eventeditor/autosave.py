@@ -1,30 +1,76 @@
+import eventeditor.journal as journal
 import eventeditor.util as util
 from evfl import EventFlow
 from pathlib import Path
 import PyQt5.QtCore as qc # type: ignore
-import queue
 import sys
 import threading
+import time
 import traceback
 import typing
 
-class TaskQueue(queue.Queue):
-    def __init__(self):
-        super().__init__()
+# Autosaves happen after every change, so favour speed over compression ratio.
+AUTOSAVE_COMPRESSION_LEVEL = 1
+
+class CoalescingTaskQueue:
+    """Runs tasks on a background thread, keeping at most one pending task.
+
+    Adding a task replaces the pending one (if any), so tasks that are added while
+    a task is running result in a single run of the latest task."""
+    def __init__(self) -> None:
+        self._cv = threading.Condition()
+        self._pending: typing.Optional[typing.Callable[[], None]] = None
+        self._busy = False
+        self.num_added = 0
+        self.num_dropped = 0
+        self.num_completed = 0
         t = threading.Thread(target=self._thread_func)
         t.daemon = True
         t.start()
 
-    def add_task(self, task):
-        self.put(task)
+    def add_task(self, task: typing.Callable[[], None]) -> None:
+        with self._cv:
+            if self._pending is not None:
+                self.num_dropped += 1
+            self._pending = task
+            self.num_added += 1
+            self._cv.notify_all()
+
+    def depth(self) -> int:
+        """Returns the number of tasks that are pending or running."""
+        with self._cv:
+            return int(self._pending is not None) + int(self._busy)
+
+    def join(self) -> None:
+        """Waits for the pending and running tasks to finish."""
+        with self._cv:
+            while self._pending is not None or self._busy:
+                self._cv.wait()
 
-    def _thread_func(self):
+    def _thread_func(self) -> None:
         while True:
-            item = self.get()
-            item()
-            self.task_done()
+            with self._cv:
+                while self._pending is None:
+                    self._cv.wait()
+                task = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                task()
+            finally:
+                with self._cv:
+                    self._busy = False
+                    self.num_completed += 1
+                    self._cv.notify_all()
 
 class AutoSaveSystem:
+    """Writes autosaves in two stages.
+
+    The flow is serialised on the main thread, so the snapshot is consistent with what the user sees
+    and cannot be torn by edits. Compressing and writing the data is then done on a worker thread.
+
+    In journal mode (the default), only changed entities are appended to a log after the first
+    snapshot; otherwise full copies are written to ten rotating files."""
     def __init__(self) -> None:
         self._save_dir: typing.Optional[Path] = None
         save_dir = qc.QStandardPaths.writableLocation(qc.QStandardPaths.AppLocalDataLocation)
@@ -32,31 +78,141 @@ class AutoSaveSystem:
             return
         self._save_dir = Path(save_dir)
         self._save_dir.mkdir(parents=True, exist_ok=True)
-        self._queue = TaskQueue()
+        self._queue = CoalescingTaskQueue()
+        self._pending_flow: typing.Optional[EventFlow] = None
+        self._pending_reason: typing.Any = None
+        self._journal: typing.Optional[journal.Journal] = None
+        if qc.QSettings().value('autosave/mode', 'journal') == 'journal':
+            self._journal = journal.Journal(self._save_dir)
+        self._timer = qc.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(qc.QSettings().value('autosave/delay_ms', 500, type=int))
+        self._timer.timeout.connect(self._serialize)
+        self._last_serialize_time = 0.0
+        self._last_write_time = 0.0
+        self._num_requested = 0
+        self._num_coalesced = 0
+        # Do not lose a debounced autosave when the application exits.
+        app = qc.QCoreApplication.instance()
+        if app:
+            app.aboutToQuit.connect(self.flush)
         self.reset()
 
     def get_directory(self) -> typing.Optional[Path]:
         return self._save_dir
 
+    def get_stats(self) -> typing.Dict[str, typing.Any]:
+        if not self._save_dir:
+            return dict()
+        # Requests are coalesced by the debounce timer first, then by the queue if a write is still running.
+        return {
+            'depth': self._queue.depth(),
+            'requested': self._num_requested,
+            'dropped': self._num_coalesced + self._queue.num_dropped,
+            'completed': self._queue.num_completed,
+            'serialize_time': self._last_serialize_time,
+            'write_time': self._last_write_time,
+        }
+
+    def flush(self) -> None:
+        """Immediately writes any pending autosave and waits for all writes to finish."""
+        if not self._save_dir:
+            return
+        if self._timer.isActive():
+            self._timer.stop()
+            self._serialize()
+        self._queue.join()
+
     def reset(self) -> None:
         if not self._save_dir:
             return
 
-        self._queue.join()
+        self.flush()
         self._current_save_idx = 0
+        self._last_digest: typing.Optional[bytes] = None
+        if self._journal:
+            self._journal.reset()
+
+    def get_name_filter(self, name: str) -> str:
+        if self._journal:
+            return f'Flowchart autosave (autosave_{name}_*{journal.JOURNAL_EXTENSION} autosave_{name}_*.bfevfl.gz)'
+        return f'Flowchart autosave (autosave_{name}_*.bfevfl.gz)'
 
-    def save(self, flow: typing.Optional[EventFlow]) -> None:
+    def save(self, flow: typing.Optional[EventFlow], reason: typing.Any = None) -> None:
         if not self._save_dir:
             return
 
+        self._num_requested += 1
+        if self._pending_flow is not None:
+            self._num_coalesced += 1
+        if self._pending_reason is None:
+            self._pending_reason = reason
+        elif reason is not None:
+            self._pending_reason |= reason
+        self._pending_flow = flow
+        self._timer.start()
+
+    def _serialize(self) -> None:
+        flow = self._pending_flow
+        reason = self._pending_reason
+        self._pending_flow = None
+        self._pending_reason = None
+        if not flow or not self._save_dir:
+            return
+
+        # Flows that cannot be journalled fall back to rotating snapshots.
+        if self._journal and self._journal.supports(flow):
+            self._serialize_journal(flow, reason)
+            return
+
+        start = time.perf_counter()
+        try:
+            data = util.serialize_flow(flow)
+        except:
+            sys.stderr.write(f'!!! Autosave failed !!!\n{traceback.format_exc()}\n\n')
+            return
+        self._last_serialize_time = time.perf_counter() - start
+
+        # Nothing has changed since the last autosave, so there is no point in using up a slot.
+        digest = util.get_flow_data_digest(data)
+        if digest == self._last_digest:
+            return
+        self._last_digest = digest
+
+        name = flow.name
         def do_write():
-            if not flow or not self._save_dir:
+            if not self._save_dir:
                 return
-            path = self._save_dir/f'autosave_{flow.name}__{self._current_save_idx}.bfevfl.gz'
+            path = self._save_dir/f'autosave_{name}__{self._current_save_idx}.bfevfl.gz'
+            start = time.perf_counter()
             try:
-                util.write_flow(str(path), flow)
+                util.write_flow_data(str(path), data, compresslevel=AUTOSAVE_COMPRESSION_LEVEL)
                 self._current_save_idx = (self._current_save_idx + 1) % 10
+            except:
+                self._last_digest = None
+                sys.stderr.write(f'!!! Autosave failed !!!\n{traceback.format_exc()}\n\n')
+            self._last_write_time = time.perf_counter() - start
+
+        self._queue.add_task(do_write)
+
+    def _serialize_journal(self, flow: EventFlow, reason: typing.Any) -> None:
+        assert self._journal
+        start = time.perf_counter()
+        try:
+            if not self._journal.prepare(flow, reason):
+                return
+        except:
+            sys.stderr.write(f'!!! Autosave failed !!!\n{traceback.format_exc()}\n\n')
+            return
+        self._last_serialize_time = time.perf_counter() - start
+
+        def do_write():
+            assert self._journal
+            start = time.perf_counter()
+            try:
+                self._journal.write_pending(compresslevel=AUTOSAVE_COMPRESSION_LEVEL)
             except:
                 sys.stderr.write(f'!!! Autosave failed !!!\n{traceback.format_exc()}\n\n')
+            self._last_write_time = time.perf_counter() - start
 
         self._queue.add_task(do_write)
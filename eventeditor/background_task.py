@@ -0,0 +1,89 @@
+import concurrent.futures
+import threading
+import typing
+
+import PyQt5.QtCore as qc # type: ignore
+import PyQt5.QtWidgets as q # type: ignore
+
+# How long a task may run before a progress dialog is shown.
+_DIALOG_DELAY_MS = 300
+_POLL_INTERVAL = 0.015
+
+# Tasks that are waited for (even when cancelled) run one at a time.
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+class TaskCancelled(Exception):
+    pass
+
+class Task:
+    """Handle that is passed to functions running in the background."""
+    def __init__(self) -> None:
+        self._cancelled = threading.Event()
+        self.progress: typing.Tuple[int, int] = (0, 0)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def report_progress(self, done: int, total: int) -> None:
+        """Updates the progress and raises TaskCancelled if the user has cancelled the task."""
+        if self.is_cancelled():
+            raise TaskCancelled()
+        self.progress = (done, total)
+
+T = typing.TypeVar('T')
+
+def _submit_abandonable(fn: typing.Callable[[Task], T], task: Task) -> 'concurrent.futures.Future[T]':
+    """Runs fn on its own daemon thread, so that a task that has been given up on cannot delay
+    later tasks (or application exit) if it does not stop promptly."""
+    future: 'concurrent.futures.Future[T]' = concurrent.futures.Future()
+    def run() -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(task))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def run_task(parent: q.QWidget, title: str, label: str, fn: typing.Callable[[Task], T], wait_on_cancel: bool = True) -> T:
+    """Runs fn on a worker thread while keeping the Qt event loop running. Returns what fn returns.
+
+    A modal progress dialog is shown if the task takes a while. Exceptions raised by fn are re-raised.
+    TaskCancelled is raised if the user cancels the task; if wait_on_cancel is False, this happens
+    immediately and the result of fn will be discarded."""
+    task = Task()
+    future = _executor.submit(fn, task) if wait_on_cancel else _submit_abandonable(fn, task)
+
+    dialog = q.QProgressDialog(label, 'Cancel', 0, 0, parent)
+    dialog.setWindowTitle(title)
+    dialog.setWindowModality(qc.Qt.WindowModal)
+    dialog.setMinimumDuration(_DIALOG_DELAY_MS)
+    dialog.setAutoReset(False)
+    dialog.setAutoClose(False)
+    dialog.canceled.connect(task.cancel)
+
+    app = q.QApplication.instance()
+    try:
+        while not future.done():
+            if dialog.wasCanceled():
+                task.cancel()
+            if task.is_cancelled() and not wait_on_cancel:
+                raise TaskCancelled()
+            done, total = task.progress
+            if total:
+                dialog.setMaximum(total)
+                dialog.setValue(done)
+            # Until the modal dialog is visible, defer user input so that the flow cannot be
+            # modified while the task is running. Everything else (e.g. painting) is processed.
+            flags = qc.QEventLoop.AllEvents if dialog.isVisible() else qc.QEventLoop.ExcludeUserInputEvents
+            app.processEvents(flags)
+            concurrent.futures.wait([future], timeout=_POLL_INTERVAL)
+    finally:
+        dialog.close()
+        dialog.deleteLater()
+
+    return future.result()
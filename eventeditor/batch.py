@@ -0,0 +1,204 @@
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import time
+import typing
+
+import eventeditor.actor_json as aj
+import eventeditor.flow_io as flow_io
+import eventeditor.flowchart_graph as fg
+import eventeditor.flowchart_tools as ft
+from evfl import EventFlow
+
+# Note: nothing in this module may import PyQt5. Batch jobs must be able to run
+# on machines without a display (or without Qt at all).
+
+FLOW_EXTENSIONS = ('.bfevfl', '.bfevfl.gz')
+
+# Result key for data that is written to the NDJSON stream instead of being printed.
+_NDJSON_RECORD_KEY = '_ndjson_record'
+
+def find_flow_files(paths: typing.Iterable[str]) -> typing.List[typing.Tuple[str, str]]:
+    """Returns (path, relative path) pairs. Relative paths are used to name output files: they are
+    relative to the directory a file was found in, or just the file name for files that were passed directly."""
+    files: typing.List[typing.Tuple[str, str]] = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append((path, os.path.basename(path)))
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend((os.path.join(root, name), os.path.relpath(os.path.join(root, name), path))
+                         for name in sorted(names) if name.endswith(FLOW_EXTENSIONS))
+    return files
+
+def _strip_flow_extension(name: str) -> str:
+    for ext in FLOW_EXTENSIONS[::-1]:
+        if name.endswith(ext):
+            return name[:-len(ext)]
+    return name
+
+def _get_output_path(output_dir: str, relative_path: str, extension: str) -> str:
+    output_path = os.path.join(output_dir, _strip_flow_extension(relative_path) + extension)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    return output_path
+
+def find_output_collision(files: typing.Iterable[typing.Tuple[str, str]]) -> typing.Optional[typing.Tuple[str, str]]:
+    """Returns two input files that would be written to the same output file, if any."""
+    seen: typing.Dict[str, str] = dict()
+    for path, relative_path in files:
+        key = os.path.normcase(os.path.normpath(_strip_flow_extension(relative_path)))
+        if key in seen:
+            return (seen[key], path)
+        seen[key] = path
+    return None
+
+def _load_flow(path: str) -> EventFlow:
+    flow = EventFlow()
+    flow_io.read_flow(path, flow)
+    return flow
+
+def _get_flow_summary(flow: EventFlow) -> typing.Dict[str, typing.Any]:
+    if not flow.flowchart:
+        return {'name': flow.name}
+    return {
+        'name': flow.name,
+        'actors': len(flow.flowchart.actors),
+        'events': len(flow.flowchart.events),
+        'entry_points': len(flow.flowchart.entry_points),
+    }
+
+def validate(path: str, options: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    flow = _load_flow(path)
+    # Ensure the flow can be written back and that graph generation does not choke on it.
+    if not flow.write(io.BytesIO()):
+        raise ValueError('Flow has neither a flowchart nor a timeline')
+    fg.get_graph(flow)
+    return _get_flow_summary(flow)
+
+def export_graph(path: str, options: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    flow = _load_flow(path)
+    graph = fg.get_graph(flow)
+    result = _get_flow_summary(flow)
+    if options['ndjson']:
+        # Serialise in the worker so that the main process only has to write strings.
+        result[_NDJSON_RECORD_KEY] = f'{{"path": {json.dumps(path)}, "name": {json.dumps(flow.name)}, "graph": {fg.dumps_graph(graph)}}}'
+        return result
+    output_path = _get_output_path(options['output'], options['relative_path'], '.json')
+    with open(output_path, 'w') as f:
+        fg.dump_graph(graph, f)
+    result['output'] = output_path
+    return result
+
+def reorder_params(path: str, options: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    aj.set_actor_definitions_path(options['actor_definitions'])
+    flow = _load_flow(path)
+    ft.reorder_event_flow_parameters(flow)
+    output_path = _get_output_path(options['output'], options['relative_path'], '.bfevfl') if options['output'] else path
+    flow_io.write_flow(output_path, flow)
+    result = _get_flow_summary(flow)
+    result['output'] = output_path
+    return result
+
+def _time_min(fn: typing.Callable[[], typing.Any], repeat: int) -> float:
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def bench_graph(path: str, options: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Compares the old way of preparing graph data for the flowchart view (json.dumps then json.loads,
+    before being converted to a QVariant) with the single-pass serialiser that is used now."""
+    flow = _load_flow(path)
+    repeat = options['repeat']
+    graph = fg.get_graph(flow)
+    result = _get_flow_summary(flow)
+    result['graph_elements'] = len(graph)
+    result['generate_time'] = _time_min(lambda: fg.get_graph(flow), repeat)
+    result['roundtrip_time'] = _time_min(lambda: json.loads(json.dumps(graph, default=lambda x: str(x))), repeat)
+    result['serialize_time'] = _time_min(lambda: fg.GraphDiffer().update(graph, -1), repeat)
+    result['speedup'] = round(result['roundtrip_time'] / result['serialize_time'], 2) if result['serialize_time'] else None
+    return result
+
+COMMANDS: typing.Dict[str, typing.Callable[[str, typing.Dict[str, typing.Any]], typing.Dict[str, typing.Any]]] = {
+    'validate': validate,
+    'export-graph': export_graph,
+    'reorder-params': reorder_params,
+    'bench-graph': bench_graph,
+}
+
+def run_command(command: str, path: str, options: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    """Runs a batch command on a single file. Errors are reported in the result instead of being raised."""
+    result: typing.Dict[str, typing.Any] = {'path': path}
+    start = time.perf_counter()
+    try:
+        result.update(COMMANDS[command](path, options))
+        result['ok'] = True
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['time'] = round(time.perf_counter() - start, 6)
+    return result
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='eventeditor-batch', description='Process event flows without starting the GUI. Results are printed as JSON lines.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    def add_command(name: str, help: str) -> argparse.ArgumentParser:
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument('paths', nargs='+', help='Event flow files or directories to search for event flows')
+        subparser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes (default: number of CPUs)')
+        return subparser
+
+    add_command('validate', 'Check that flows can be parsed, written and turned into a graph')
+    export_parser = add_command('export-graph', 'Export graph data to JSON (one file per flow, or a single NDJSON stream)')
+    export_output_group = export_parser.add_mutually_exclusive_group(required=True)
+    export_output_group.add_argument('-o', '--output', help='Output directory (subdirectories of input directories are mirrored)')
+    export_output_group.add_argument('--ndjson', help='Write all graphs to this file, one JSON object per line')
+    reorder_parser = add_command('reorder-params', 'Reorder event parameters using actor definitions')
+    reorder_parser.add_argument('--actor-definitions', required=True, help='Path to the actor definition JSON file')
+    reorder_parser.add_argument('-o', '--output', help='Output directory; subdirectories of input directories are mirrored (default: overwrite input files)')
+    bench_parser = add_command('bench-graph', 'Benchmark graph serialisation for the flowchart view (use -j 1 for stable timings)')
+    bench_parser.add_argument('--repeat', type=int, default=5, help='Number of runs; the fastest one is reported (default: 5)')
+
+    args = parser.parse_args(argv)
+    options = {k: v for k, v in vars(args).items() if k not in ('command', 'paths', 'jobs')}
+    files = find_flow_files(args.paths)
+    if options.get('output'):
+        collision = find_output_collision(files)
+        if collision:
+            parser.error(f'{collision[0]} and {collision[1]} would be written to the same output file')
+        os.makedirs(options['output'], exist_ok=True)
+
+    num_failed = 0
+    ndjson_file = open(options['ndjson'], 'w') if options.get('ndjson') else None
+    start = time.perf_counter()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(run_command, args.command, path, dict(options, relative_path=relative_path))
+                       for path, relative_path in files]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if not result['ok']:
+                    num_failed += 1
+                record = result.pop(_NDJSON_RECORD_KEY, None)
+                if ndjson_file and record is not None:
+                    ndjson_file.write(record + '\n')
+                sys.stdout.write(json.dumps(result) + '\n')
+                sys.stdout.flush()
+    finally:
+        if ndjson_file:
+            ndjson_file.close()
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(f'{len(files)} flow(s) processed in {elapsed:.3f} s ({len(files) / elapsed if elapsed else 0:.1f} flows/s), {num_failed} failed\n')
+    sys.exit(1 if num_failed else 0)
+
+if __name__ == '__main__':
+    main()
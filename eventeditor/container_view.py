@@ -1,6 +1,5 @@
 from enum import IntEnum, auto
 import typing
-import yaml
 
 from eventeditor.container_model import ContainerModel, ContainerModelColumn
 from eventeditor.data_editors import CustomTableView
@@ -82,6 +81,7 @@ class ContainerAddItemDialog(q.QDialog):
         self.value_widget.setCurrentIndex(btn_id)
 
     def parseValue(self) -> typing.Any:
+        import yaml
         try:
             data = yaml.load(self.tedit.toPlainText(), Loader=yaml.SafeLoader)
         except yaml.parser.ParserError as e:
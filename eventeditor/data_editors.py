@@ -1,7 +1,6 @@
 import copy
 import traceback
 import typing
-import yaml
 
 import eventeditor.util as util
 from evfl import ActorIdentifier
@@ -44,6 +43,7 @@ class ArrayEditDialog(q.QDialog):
         self.data = data
         self.setWindowTitle(f'Edit {type(self.data[0]).__name__} array')
 
+        import yaml
         label = q.QLabel('New array data:')
         self.tedit = q.QPlainTextEdit()
         font = qg.QFontDatabase.systemFont(qg.QFontDatabase.FixedFont)
@@ -61,6 +61,7 @@ class ArrayEditDialog(q.QDialog):
         btn_box.rejected.connect(self.reject)
 
     def accept(self) -> None:
+        import yaml
         try:
             data = yaml.load(self.tedit.toPlainText(), Loader=yaml.SafeLoader)
         except yaml.parser.ParserError as e:
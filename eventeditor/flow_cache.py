@@ -0,0 +1,140 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+import pickle
+import threading
+import typing
+
+import evfl
+from evfl import Event, EventFlow, Flowchart
+
+# Bump this whenever the layout of cache entries changes.
+_CACHE_FORMAT_VERSION = 1
+
+class _FlowPickler(pickle.Pickler):
+    # Events are pickled by index. Following event links recursively would otherwise
+    # hit the recursion limit on long event chains.
+    def __init__(self, f: typing.BinaryIO, event_idx: typing.Dict[int, int]) -> None:
+        super().__init__(f, protocol=4)
+        self._event_idx = event_idx
+
+    def persistent_id(self, obj):
+        return self._event_idx.get(id(obj)) if type(obj) is Event else None
+
+class _FlowUnpickler(pickle.Unpickler):
+    def __init__(self, f: typing.BinaryIO, events: typing.List[Event]) -> None:
+        super().__init__(f)
+        self._events = events
+
+    def persistent_load(self, pid):
+        return self._events[pid]
+
+FileKey = typing.Tuple[str, int, int, str]
+
+def get_file_key(path: str) -> FileKey:
+    """Returns the key of the current contents of a file: (absolute path, mtime, size, content hash).
+
+    This should be computed before the file is parsed, so that a parse of older contents
+    can never be stored under the key of newer ones."""
+    st = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size, h.hexdigest())
+
+class FlowCache:
+    """On-disk cache of parsed event flows.
+
+    Entries are keyed by path, mtime, size and content hash of the source file.
+    The least recently used entries are evicted once the cache exceeds max_size bytes."""
+    def __init__(self, directory: Path, max_size: int = 256 << 20) -> None:
+        self._directory = directory
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self) -> typing.Dict[str, typing.Any]:
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total else 0.0}
+
+    def _get_entry_path(self, key: FileKey) -> Path:
+        return self._directory/(hashlib.blake2b(key[0].encode(), digest_size=16).hexdigest() + '.pickle')
+
+    def load(self, key: FileKey, flow: EventFlow) -> bool:
+        """Fills flow from the cache (see get_file_key). Returns False on a cache miss."""
+        entry_path = self._get_entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                header = pickle.load(f)
+                if header != (_CACHE_FORMAT_VERSION, evfl.__version__, key):
+                    raise KeyError(key[0])
+                num_events = pickle.load(f)
+                events = [Event() for i in range(num_events)]
+                name, flowchart_name, actors, entry_points, event_data = _FlowUnpickler(f, events).load()
+        except Exception:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        for event, (event_name, data) in zip(events, event_data):
+            event.name = event_name
+            event.data = data
+        flowchart = Flowchart()
+        flowchart.name = flowchart_name
+        flowchart.actors = actors
+        flowchart.events = events
+        flowchart.entry_points = entry_points
+        flow.name = name
+        flow.flowchart = flowchart
+        flow.timeline = None
+
+        # Mark the entry as recently used.
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key: FileKey, flow: EventFlow) -> None:
+        """Stores a flow that was parsed from the file with the specified key (see get_file_key)."""
+        # Timelines are not supported by the editor, so there is no point in caching them.
+        if not flow.flowchart or flow.timeline:
+            return
+        fc = flow.flowchart
+        buf = io.BytesIO()
+        pickle.dump((_CACHE_FORMAT_VERSION, evfl.__version__, key), buf, protocol=4)
+        pickle.dump(len(fc.events), buf, protocol=4)
+        _FlowPickler(buf, {id(event): i for i, event in enumerate(fc.events)}).dump(
+            (flow.name, fc.name, fc.actors, fc.entry_points, [(event.name, event.data) for event in fc.events]))
+
+        entry_path = self._get_entry_path(key)
+        tmp_path = str(entry_path) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buf.getbuffer())
+        os.replace(tmp_path, entry_path)
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in self._directory.glob('*.pickle'):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+            total_size -= size
@@ -26,7 +26,7 @@ class FlowData(qc.QObject):
 
         self.auto_save = AutoSaveSystem()
         self.fileLoaded.connect(lambda: self.auto_save.reset())
-        self.flowDataChanged.connect(lambda reason: self.auto_save.save(self.flow))
+        self.flowDataChanged.connect(self._onFlowDataChanged)
 
         self.flow: typing.Optional[EventFlow] = None
 
@@ -50,6 +50,12 @@ class FlowData(qc.QObject):
 
         self._next_event_idx = self.computeNextEventIdx()
 
+    def _onFlowDataChanged(self, reason: FlowDataChangeReason) -> None:
+        # A flow that has just been loaded has nothing to recover. Not autosaving it also
+        # keeps the autosaves of the previous session around until something is edited.
+        if reason != FlowDataChangeReason.Reset:
+            self.auto_save.save(self.flow, reason)
+
     def computeNextEventIdx(self) -> int:
         if not self.flow or not self.flow.flowchart:
             return -1
@@ -0,0 +1,162 @@
+import eventeditor.pack_io as pack_io
+import evfl.evfl
+import gzip
+import hashlib
+import io
+import mmap
+import os
+import struct
+import traceback
+import typing
+
+if typing.TYPE_CHECKING:
+    from eventeditor.flow_cache import FlowCache
+
+# Autosave journals are handled by eventeditor.journal, which depends on this module.
+JOURNAL_EXTENSION = '.evjournal'
+
+_GZIP_READ_CHUNK_SIZE = 1 << 20
+# Deflate cannot compress data by more than about 1032:1.
+_MAX_DEFLATE_RATIO = 1032
+_WRITE_CHUNK_SIZE = 1 << 20
+
+# Called with (bytes done, bytes total). May raise to abort the operation.
+ProgressCallback = typing.Callable[[int, int], None]
+
+def _read_gzip(path: str, progress: typing.Optional[ProgressCallback] = None) -> bytearray:
+    with open(path, 'rb') as raw:
+        # The gzip trailer stores the uncompressed size (modulo 2^32), which lets us
+        # allocate the output buffer once and decompress straight into it.
+        # It is only a hint: truncated files (e.g. an interrupted autosave) can contain anything
+        # there, so the allocation is bounded by what the compressed data could possibly expand to.
+        compressed_size = raw.seek(-4, os.SEEK_END) + 4
+        size = min(struct.unpack('<I', raw.read(4))[0], compressed_size * _MAX_DEFLATE_RATIO)
+        raw.seek(0)
+        buf = bytearray(size)
+        pos = 0
+        with memoryview(buf) as view, gzip.GzipFile(fileobj=raw) as f:
+            while pos < size:
+                n = f.readinto(view[pos:pos + _GZIP_READ_CHUNK_SIZE])
+                if not n:
+                    break
+                pos += n
+                if progress:
+                    progress(pos, size)
+            # Only non-empty if the trailer is wrong (multi-member or >4 GiB streams).
+            rest = f.read()
+        del buf[pos:]
+        buf += rest
+        return buf
+
+def read_flow_data(path: str) -> bytes:
+    if pack_io.is_pack_path(path):
+        return pack_io.read_pack_file(path)
+    if path.endswith('.gz'):
+        return _read_gzip(path) # type: ignore
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_flow(path: str, flow: evfl.evfl.EventFlow, progress: typing.Optional[ProgressCallback] = None,
+              cache: typing.Optional['FlowCache'] = None):
+    if path.endswith(JOURNAL_EXTENSION):
+        import eventeditor.journal as journal
+        journal.read_journal(path, flow)
+        return
+
+    # Archives have their own cache of decompressed data.
+    if pack_io.is_pack_path(path):
+        flow.read(pack_io.read_pack_file(path))
+        return
+
+    if cache:
+        from eventeditor.flow_cache import get_file_key
+        # Computed once, before parsing: if the file changes in the meantime, the parse is stored
+        # under the old key and will not be used for the new contents.
+        key = get_file_key(path)
+        if cache.load(key, flow):
+            return
+        _parse_flow(path, flow, progress)
+        # The cache is only an optimisation, so failing to update it must not fail the load.
+        try:
+            cache.store(key, flow)
+        except:
+            traceback.print_exc()
+        return
+
+    _parse_flow(path, flow, progress)
+
+def _parse_flow(path: str, flow: evfl.evfl.EventFlow, progress: typing.Optional[ProgressCallback]):
+    if path.endswith('.gz'):
+        flow.read(_read_gzip(path, progress)) # type: ignore
+        return
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            flow.read(b'')
+            return
+        # evfl needs bytes-like data that supports find() and slicing, which mmap provides.
+        # evfl still copies the data into its own stream, but reading through a mapping avoids
+        # holding a second copy in a bytes object.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            flow.read(data) # type: ignore
+
+def serialize_flow(flow: evfl.evfl.EventFlow) -> bytes:
+    buf = io.BytesIO()
+    flow.write(buf)
+    return buf.getvalue()
+
+def get_flow_data_digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+# Path -> (digest of the serialised flow, mtime_ns, size) for the last write made by us.
+_last_writes: typing.Dict[str, typing.Tuple[bytes, int, int]] = dict()
+
+def _is_unchanged_since_last_write(path: str, digest: bytes) -> bool:
+    last_write = _last_writes.get(path)
+    if not last_write or last_write[0] != digest:
+        return False
+    # Do not skip the write if the file has been modified or deleted by someone else.
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (st.st_mtime_ns, st.st_size) == last_write[1:]
+
+def write_flow(path: str, flow: evfl.evfl.EventFlow, compresslevel: int = 9) -> bool:
+    return write_flow_data(path, serialize_flow(flow), compresslevel)
+
+def write_flow_data(path: str, data: bytes, compresslevel: int = 9, progress: typing.Optional[ProgressCallback] = None) -> bool:
+    """Writes serialised flow data to path atomically.
+
+    Returns False without touching the disk if the file already contains exactly this data."""
+    if pack_io.is_pack_path(path):
+        return pack_io.write_pack_file(path, data)
+
+    key = os.path.abspath(path)
+    digest = get_flow_data_digest(data)
+    if _is_unchanged_since_last_write(key, digest):
+        return False
+
+    try:
+        # Write in bounded chunks to report progress, and for gzip, to avoid also holding
+        # the entire compressed output in memory.
+        if path.endswith('.gz'):
+            f = gzip.open(path + '.tmp', 'wb', compresslevel=compresslevel)
+        else:
+            f = open(path + '.tmp', 'wb')
+        with f, memoryview(data) as view:
+            for i in range(0, len(view), _WRITE_CHUNK_SIZE):
+                f.write(view[i:i + _WRITE_CHUNK_SIZE])
+                if progress:
+                    progress(min(i + _WRITE_CHUNK_SIZE, len(view)), len(view))
+        os.replace(path + '.tmp', path)
+    except:
+        try:
+            os.unlink(path + '.tmp')
+        except FileNotFoundError:
+            pass
+        raise
+
+    st = os.stat(path)
+    _last_writes[key] = (digest, st.st_mtime_ns, st.st_size)
+    return True
@@ -0,0 +1,360 @@
+import json
+import types
+import typing
+
+from evfl import Event, EventFlow, ActionEvent, SwitchEvent, ForkEvent, JoinEvent, SubFlowEvent
+from evfl.entry_point import EntryPoint
+from evfl.repr_util import generate_flowchart_graph
+from evfl.util import make_values_to_index_map
+
+# Graph data helpers that are shared by the flowchart view and batch tools.
+# This module must not depend on Qt.
+
+# Regions that have fewer events than this are not worth collapsing.
+_MIN_REGION_SIZE = 3
+
+def get_graph(flow: typing.Optional[EventFlow], entry_points: typing.Optional[typing.Collection[EntryPoint]] = None,
+              reachability: typing.Optional['ReachabilityCache'] = None, events: typing.Collection[Event] = ()) -> list:
+    """Returns graph data for a flow.
+
+    If entry_points is specified, only events that are reachable from those entry points or from events
+    are included. Nodes for other entry points have no edges and 'unloaded' set in their data."""
+    if not flow:
+        return []
+    if entry_points is None or not flow.flowchart:
+        graph = generate_flowchart_graph(flow)
+    else:
+        graph = _generate_partial_graph(flow, entry_points, reachability or ReachabilityCache(), events)
+    if flow.flowchart:
+        add_components(graph)
+        add_regions(graph, _get_fork_joins(flow))
+    return graph
+
+def add_components(graph: list) -> None:
+    """Adds the ID of the weakly connected component that contains each node ('component').
+
+    Components are identified by their smallest node ID, so that the ID of a component does not change
+    when other parts of the graph are edited (and unchanged nodes do not need to be sent again)."""
+    parent: typing.Dict[int, int] = {element['id']: element['id'] for element in graph if element['type'] == 'node'}
+
+    def find(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for element in graph:
+        if element['type'] != 'edge' or element['source'] not in parent or element['target'] not in parent:
+            continue
+        a = find(element['source'])
+        b = find(element['target'])
+        if a < b:
+            parent[b] = a
+        elif b < a:
+            parent[a] = b
+
+    for element in graph:
+        if element['type'] == 'node':
+            element['component'] = find(element['id'])
+
+def get_event_successors(event: Event) -> typing.List[Event]:
+    data = event.data
+    if isinstance(data, (ActionEvent, JoinEvent, SubFlowEvent)):
+        return [data.nxt.v] if data.nxt.v else []
+    if isinstance(data, SwitchEvent):
+        return [case.v for case in data.cases.values() if case.v]
+    if isinstance(data, ForkEvent):
+        return [fork.v for fork in data.forks if fork.v] + ([data.join.v] if data.join.v else [])
+    return []
+
+class ReachabilityCache:
+    """Caches the set of events that are reachable from each entry point (or event).
+
+    This must be cleared whenever events or links between events change."""
+    def __init__(self) -> None:
+        self._reachable: typing.Dict[typing.Union[EntryPoint, Event], typing.FrozenSet[Event]] = dict()
+
+    def clear(self) -> None:
+        self._reachable.clear()
+
+    def get(self, start: typing.Union[EntryPoint, Event]) -> typing.FrozenSet[Event]:
+        reachable = self._reachable.get(start)
+        if reachable is None:
+            visited: typing.Set[Event] = set()
+            if isinstance(start, EntryPoint):
+                stack = [start.main_event.v] if start.main_event.v else []
+            else:
+                stack = [start]
+            while stack:
+                event = stack.pop()
+                if event in visited:
+                    continue
+                visited.add(event)
+                stack.extend(get_event_successors(event))
+            reachable = frozenset(visited)
+            self._reachable[start] = reachable
+        return reachable
+
+def _generate_partial_graph(flow: EventFlow, entry_points: typing.Collection[EntryPoint], reachability: ReachabilityCache,
+                            extra_events: typing.Collection[Event]) -> list:
+    flowchart = flow.flowchart
+    reachable: typing.Set[Event] = set()
+    loaded_entry_points = [ep for ep in flowchart.entry_points if ep in entry_points]
+    for entry_point in loaded_entry_points:
+        reachable |= reachability.get(entry_point)
+    for event in extra_events:
+        reachable |= reachability.get(event)
+
+    # The graph generator also adds events that are not linked from any entry point, so it must only see
+    # reachable events. Node IDs are indices in the lists it sees and must be mapped back.
+    event_idx_map = make_values_to_index_map(flowchart.events)
+    events = [event for event in flowchart.events if event in reachable]
+    ep_idx_map = make_values_to_index_map(flowchart.entry_points)
+    node_ids = [event_idx_map[event] for event in events]
+    entry_point_ids = [-1000-ep_idx_map[ep] for ep in loaded_entry_points]
+    partial_flow = types.SimpleNamespace(flowchart=types.SimpleNamespace(
+        actors=flowchart.actors, events=events, entry_points=loaded_entry_points))
+    graph = generate_flowchart_graph(typing.cast(EventFlow, partial_flow))
+
+    def get_id(partial_id: int) -> int:
+        return node_ids[partial_id] if partial_id >= 0 else entry_point_ids[-1000-partial_id]
+
+    for element in graph:
+        if element['type'] == 'node':
+            element['id'] = get_id(element['id'])
+        else:
+            element['source'] = get_id(element['source'])
+            element['target'] = get_id(element['target'])
+
+    for i, entry_point in enumerate(flowchart.entry_points):
+        if entry_point not in entry_points:
+            graph.append({'type': 'node', 'id': -1000-i, 'node_type': 'entry', 'data': {'name': entry_point.name, 'unloaded': True}})
+    return graph
+
+def _get_fork_joins(flow: EventFlow) -> typing.Dict[int, int]:
+    event_idx_map = make_values_to_index_map(flow.flowchart.events)
+    joins: typing.Dict[int, int] = dict()
+    for idx, event in enumerate(flow.flowchart.events):
+        if isinstance(event.data, ForkEvent) and event.data.join.v in event_idx_map:
+            joins[idx] = event_idx_map[event.data.join.v]
+    return joins
+
+def _get_immediate_dominators(succs: typing.List[typing.List[int]], preds: typing.List[typing.List[int]]) -> typing.List[int]:
+    """Returns the immediate dominator of each node (nodes are indices), or -1 if a node is only
+    dominated by a virtual root.
+
+    The virtual root precedes all nodes without predecessors, as well as one node of every cycle
+    that cannot be reached from those. Uses the Cooper-Harvey-Kennedy algorithm."""
+    n = len(succs)
+    root = n
+    is_root_child = [False] * n
+    postorder: typing.List[int] = []
+    visited = [False] * n
+
+    def visit(start: int) -> None:
+        is_root_child[start] = True
+        visited[start] = True
+        stack = [(start, iter(succs[start]))]
+        while stack:
+            node, it = stack[-1]
+            for succ in it:
+                if not visited[succ]:
+                    visited[succ] = True
+                    stack.append((succ, iter(succs[succ])))
+                    break
+            else:
+                stack.pop()
+                postorder.append(node)
+
+    for node in range(n):
+        if not preds[node] and not visited[node]:
+            visit(node)
+    for node in range(n):
+        if not visited[node]:
+            visit(node)
+
+    postorder.append(root)
+    order = [0] * (n + 1)
+    for i, node in enumerate(postorder):
+        order[node] = i
+    idom = [-1] * (n + 1)
+    idom[root] = root
+
+    changed = True
+    while changed:
+        changed = False
+        for node in reversed(postorder[:-1]):
+            # In reverse postorder, at least one predecessor (the DFS parent) has already been processed.
+            new_idom = root if is_root_child[node] else -1
+            for pred in preds[node]:
+                if idom[pred] == -1:
+                    continue
+                if new_idom == -1:
+                    new_idom = pred
+                    continue
+                a = pred
+                while a != new_idom:
+                    while order[a] < order[new_idom]:
+                        a = idom[a]
+                    while order[new_idom] < order[a]:
+                        new_idom = idom[new_idom]
+            if idom[node] != new_idom:
+                idom[node] = new_idom
+                changed = True
+    return [-1 if d == root else d for d in idom[:n]]
+
+def add_regions(graph: list, fork_joins: typing.Dict[int, int]) -> None:
+    """Adds a region hierarchy to graph data, so that the view can collapse parts of the graph.
+
+    A region starts at a fork (and ends at its join, inclusive) or at a switch (and ends just before
+    the point where its branches reconverge, i.e. its immediate post-dominator). Only events that
+    are dominated by the first event of the region are part of it, so every region has a single entry.
+    Regions that would partially overlap are dropped.
+
+    Each node gets a 'region' key with the ID of the innermost region that contains it (or None),
+    and a 'region' element is added for every region: {id (= ID of the first node), kind, parent, size}."""
+    node_elements = [element for element in graph if element['type'] == 'node']
+    index_of = {element['id']: i for i, element in enumerate(node_elements)}
+    n = len(node_elements)
+    succs: typing.List[typing.List[int]] = [[] for i in range(n)]
+    preds: typing.List[typing.List[int]] = [[] for i in range(n)]
+    for element in graph:
+        if element['type'] == 'edge':
+            source = index_of.get(element['source'])
+            target = index_of.get(element['target'])
+            if source is not None and target is not None:
+                succs[source].append(target)
+                preds[target].append(source)
+
+    idom = _get_immediate_dominators(succs, preds)
+    ipdom = _get_immediate_dominators(preds, succs)
+    # The last list is for the virtual root.
+    dom_children: typing.List[typing.List[int]] = [[] for i in range(n + 1)]
+    for node in range(n):
+        dom_children[idom[node]].append(node)
+
+    # Region head -> (kind, node at which the region ends or -1, whether that node is part of the region).
+    candidates: typing.Dict[int, typing.Tuple[str, int, bool]] = dict()
+    for node, element in enumerate(node_elements):
+        if element['node_type'] == 'fork' and element['id'] in fork_joins:
+            candidates[node] = ('fork', index_of.get(fork_joins[element['id']], -1), True)
+        elif element['node_type'] == 'switch' and len(set(succs[node])) >= 2:
+            candidates[node] = ('switch', ipdom[node], False)
+    ends = {end for kind, end, inclusive in candidates.values()}
+
+    # Regions are subtrees of the dominator tree, minus the subtree of their end node (if it is dominated
+    # by the head). Walk the dominator tree with a stack of open regions. A region is invalid if it is still
+    # open when a region that encloses it ends.
+    invalid: typing.Set[int] = set()
+    while True:
+        region_of = [-1] * n
+        parents: typing.Dict[int, int] = dict()
+        newly_invalid: typing.Set[int] = set()
+
+        def close(active: typing.Tuple[int, ...], node: int, inclusive: bool) -> typing.Tuple[int, ...]:
+            for i, head in enumerate(active):
+                kind, end, end_inclusive = candidates[head]
+                if end == node and end_inclusive == inclusive:
+                    newly_invalid.update(active[i+1:])
+                    return active[:i]
+            return active
+
+        stack: typing.List[typing.Tuple[int, typing.Tuple[int, ...]]] = [(node, ()) for node in reversed(dom_children[n])]
+        while stack:
+            node, active = stack.pop()
+            if node in ends:
+                active = close(active, node, False)
+            if node in candidates and node not in invalid:
+                parents[node] = active[-1] if active else -1
+                active = active + (node,)
+            region_of[node] = active[-1] if active else -1
+            if node in ends:
+                active = close(active, node, True)
+            stack.extend((child, active) for child in reversed(dom_children[node]))
+
+        if not newly_invalid - invalid:
+            break
+        invalid |= newly_invalid
+
+    # Drop regions that are too small. Sizes include nested regions, so these are always leaves.
+    sizes = {head: 0 for head in parents}
+    for head in region_of:
+        if head != -1:
+            sizes[head] += 1
+    # Parents are always opened before their children.
+    for head in reversed(list(parents.keys())):
+        if parents[head] != -1:
+            sizes[parents[head]] += sizes[head]
+    kept = {head for head, size in sizes.items() if size >= _MIN_REGION_SIZE}
+
+    def get_kept_id(head: int) -> typing.Optional[int]:
+        while head != -1 and head not in kept:
+            head = parents[head]
+        return None if head == -1 else node_elements[head]['id']
+
+    for node, element in enumerate(node_elements):
+        element['region'] = get_kept_id(region_of[node])
+    for head in sorted(kept, key=lambda head: node_elements[head]['id']):
+        graph.append({
+            'type': 'region',
+            'id': node_elements[head]['id'],
+            'kind': candidates[head][0],
+            'parent': get_kept_id(parents[head]),
+            'size': sizes[head],
+        })
+
+def dump_graph(graph: list, f: typing.TextIO) -> None:
+    json.dump(graph, f, default=lambda x: str(x))
+
+def dumps_graph(graph: list) -> str:
+    return json.dumps(graph, default=lambda x: str(x))
+
+_encode_element = json.JSONEncoder(default=lambda x: str(x), check_circular=False, separators=(',', ':')).encode
+
+def _get_element_key(element: dict) -> tuple:
+    if element['type'] in ('node', 'region'):
+        return (element['type'], element['id'])
+    return ('edge', element['source'], element['target'], element['data'].get('value'))
+
+def _make_removed_element(key: tuple) -> dict:
+    if key[0] in ('node', 'region'):
+        return {'type': key[0], 'id': key[1]}
+    return {'type': 'edge', 'source': key[1], 'target': key[2], 'data': {} if key[3] is None else {'value': key[3]}}
+
+class GraphDiffer:
+    """Keeps track of the graph that the flowchart view has and computes what has changed since then.
+
+    Each update has a revision number. The view sends back the revision it has: if it does not match
+    the last one that was computed (e.g. because the page was reloaded), the whole graph is sent again."""
+    def __init__(self) -> None:
+        self.revision = 0
+        # Element key -> JSON encoding. Elements reference live flow data (e.g. parameter dicts),
+        # so they must be snapshotted to detect in-place changes.
+        self._elements: typing.Dict[tuple, str] = dict()
+
+    def reset(self) -> None:
+        """Forces the next update to contain the whole graph."""
+        self.revision += 1
+        self._elements = dict()
+
+    def update(self, graph: list, base_revision: int) -> str:
+        """Returns the changes as a JSON string.
+
+        Elements are encoded exactly once and the string is assembled from those encodings, so the
+        graph is traversed a single time and the view can decode everything with one JSON.parse call."""
+        elements = {_get_element_key(element): _encode_element(element) for element in graph}
+        full = base_revision != self.revision
+        if full:
+            added = list(elements.values())
+            updated: typing.List[str] = []
+            removed: typing.List[dict] = []
+        else:
+            old_elements = self._elements
+            added = [data for key, data in elements.items() if key not in old_elements]
+            updated = [data for key, data in elements.items() if key in old_elements and old_elements[key] != data]
+            removed = [_make_removed_element(key) for key in old_elements.keys() - elements.keys()]
+
+        self.revision += 1
+        self._elements = elements
+        return (f'{{"revision":{self.revision},"full":{"true" if full else "false"},'
+                f'"added":[{",".join(added)}],"updated":[{",".join(updated)}],"removed":{_encode_element(removed)}}}')
@@ -1,4 +1,5 @@
 import json
+import os
 import typing
 
 import eventeditor.actor_json as aj
@@ -9,16 +10,15 @@ from eventeditor.event_edit_dialog import show_event_editor
 from eventeditor.event_chooser_dialog import show_event_type_chooser, add_new_event, EventChooserDialog, CheckableEventParentListWidget
 from eventeditor.event_fork_chooser_dialog import EventForkChooserDialog
 from eventeditor.flow_data import FlowData, FlowDataChangeReason
+import eventeditor.flowchart_graph as fg
 import eventeditor.flowchart_tools as ft
+from eventeditor.layout_cache import LayoutCache
 from eventeditor.search_bar import SearchBar
 from eventeditor.util import *
 from evfl import Container, Flowchart, Actor, Event, EventFlow, ActionEvent, SwitchEvent, ForkEvent, JoinEvent, SubFlowEvent
 from evfl.common import Index, RequiredIndex
 from evfl.entry_point import EntryPoint
 from evfl.enums import EventType
-from evfl.repr_util import generate_flowchart_graph
-from PyQt5.QtWebChannel import QWebChannel # type: ignore
-from PyQt5.QtWebEngineWidgets import QWebEngineView # type: ignore
 import PyQt5.QtCore as qc # type: ignore
 import PyQt5.QtGui as qg # type: ignore
 import PyQt5.QtWidgets as q # type: ignore
@@ -35,14 +35,61 @@ class FlowchartWebObject(qc.QObject):
     def __init__(self, view) -> None:
         super().__init__(view)
         self.view: FlowchartView = view
-
-    @qc.pyqtSlot(result=qc.QVariant)
-    def getJson(self) -> qc.QVariant:
-        return qc.QVariant(json.loads(json.dumps(self.getData(), default=lambda x: str(x))))
+        self.graph_differ = fg.GraphDiffer()
+        self.reachability = fg.ReachabilityCache()
+        # Names of the entry points whose events are sent to the view (in lazy mode).
+        self.loaded_entry_points: typing.Set[str] = set()
+        # Events that are sent to the view (in lazy mode) even though no loaded entry point reaches them,
+        # e.g. events that have just been added.
+        self.loaded_events: typing.Set[Event] = set()
+
+    @qc.pyqtSlot(int, result=str)
+    def getGraphUpdate(self, revision: int) -> str:
+        """Returns the changes to the graph since the specified revision as a JSON string.
+        Strings are much cheaper to send over the web channel than nested QVariants."""
+        return self.graph_differ.update(self.getData(), int(revision))
+
+    def isLazy(self) -> bool:
+        """In lazy mode, events are only sent to the view once their entry point has been selected."""
+        flow = self.view.flow_data.flow
+        threshold = qc.QSettings().value('flowchart/lazy_threshold', 20, type=int)
+        return bool(flow and flow.flowchart and threshold > 0 and len(flow.flowchart.entry_points) >= threshold)
 
     def getData(self) -> list:
         flow = self.view.flow_data.flow
-        return generate_flowchart_graph(flow) if flow else []
+        if not self.isLazy():
+            return fg.get_graph(flow)
+        entry_points = [ep for ep in flow.flowchart.entry_points if ep.name in self.loaded_entry_points]
+        return fg.get_graph(flow, entry_points, self.reachability, self.loaded_events)
+
+    @qc.pyqtSlot(int)
+    def loadEntryPoint(self, node_id: int) -> None:
+        self.view.loadEntryPoints([-1000-int(node_id)])
+
+    @qc.pyqtSlot()
+    def loadAllEntryPoints(self) -> None:
+        if self.view.flow_data.flow and self.view.flow_data.flow.flowchart:
+            self.view.loadEntryPoints(range(len(self.view.flow_data.flow.flowchart.entry_points)))
+
+    @qc.pyqtSlot(result=str)
+    def getRendererSettings(self) -> str:
+        settings = qc.QSettings()
+        return json.dumps({
+            # 'svg', 'canvas', or 'auto' to use a canvas for flowcharts with at least canvas_threshold events.
+            'renderer': settings.value('flowchart/renderer', 'auto'),
+            'canvasThreshold': settings.value('flowchart/canvas_threshold', 2000, type=int),
+            # Fork/join and switch regions start collapsed in flowcharts with at least this many events.
+            'collapseThreshold': settings.value('flowchart/collapse_threshold', 1000, type=int),
+            'layoutCacheMaxSize': self.view.getLayoutCacheMaxSize(),
+        })
+
+    @qc.pyqtSlot(result=str)
+    def getLayouts(self) -> str:
+        return self.view.layout_cache.get_json()
+
+    @qc.pyqtSlot(str, str)
+    def storeLayouts(self, entries: str, used_keys: str) -> None:
+        self.view.layout_cache.update(json.loads(entries), json.loads(used_keys))
 
     @qc.pyqtSlot()
     def emitReadySignal(self):
@@ -116,7 +163,18 @@ class FlowchartView(q.QWidget):
         self.initLayout()
         self.connectWidgets()
 
+    @staticmethod
+    def getLayoutCacheMaxSize() -> int:
+        return max(0, qc.QSettings().value('cache/layout_max_size_mb', 32, type=int)) << 20
+
     def initWidgets(self) -> None:
+        # Component layouts are expensive to compute for large flows, so they are kept across sessions.
+        self.layout_cache = LayoutCache(os.path.join(os.path.dirname(qc.QSettings().fileName()), 'layout_cache.json'),
+                                        self.getLayoutCacheMaxSize())
+        app = qc.QCoreApplication.instance()
+        if app:
+            app.aboutToQuit.connect(self.layout_cache.save)
+
         self.web_object = FlowchartWebObject(self)
         self.flow_data.flowDataChanged.connect(self.onFlowDataChanged)
         self.flow_data.fileLoaded.connect(self.web_object.fileLoaded)
@@ -125,13 +183,13 @@ class FlowchartView(q.QWidget):
         self.eventParamVisibilityChanged.connect(self.onEventParamVisibilityChanged)
         self.eventParamVisibilityChanged.connect(self.web_object.eventParamVisibilityChanged)
 
-        self.view = QWebEngineView()
-        self.view.setContextMenuPolicy(qc.Qt.NoContextMenu)
-        self.channel = QWebChannel()
-        self.channel.registerObject('widget', self.web_object)
-        self.view.page().setWebChannel(self.channel)
-        self.view.page().setBackgroundColor(qg.QColor(0x38, 0x38, 0x38));
-        self.view.setUrl(qc.QUrl.fromLocalFile(get_path('assets/index.html')))
+        # Starting the web engine takes most of the launch time, so it is only created once it is needed
+        # (see createWebView). Until then, this is an empty placeholder.
+        self.view = None
+        self.view_container = q.QWidget()
+        self.view_layout = q.QVBoxLayout(self.view_container)
+        self.view_layout.setContentsMargins(0, 0, 0, 0)
+        self.flow_data.fileLoaded.connect(lambda flow: self.createWebView())
 
         self.entry_point_view = q.QListView(self)
         self.ep_proxy_model = qc.QSortFilterProxyModel(self)
@@ -147,9 +205,14 @@ class FlowchartView(q.QWidget):
         self.container_stacked_widget.addWidget(q.QWidget())
         self.container_stacked_widget.addWidget(self.container_view)
 
-        self.update_timer = qc.QTimer(self)
-        self.update_timer.timeout.connect(self.web_object.flowDataChanged)
-        self.update_timer.setSingleShot(True)
+        # Operations such as adding a fork change the flow several times in a row. Refreshes are
+        # coalesced so that the view only reloads once (at most once per interval).
+        self.refresh_timer = qc.QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(qc.QSettings().value('flowchart/refresh_interval', 16, type=int))
+        self.refresh_timer.timeout.connect(self.web_object.flowDataChanged)
+        # Set if the flow has changed while the view was hidden.
+        self.needs_refresh = False
 
     def initLayout(self) -> None:
         left_pane_splitter = q.QSplitter(qc.Qt.Vertical)
@@ -164,7 +227,7 @@ class FlowchartView(q.QWidget):
 
         splitter = q.QSplitter()
         splitter.addWidget(left_pane_splitter)
-        splitter.addWidget(self.view)
+        splitter.addWidget(self.view_container)
         splitter.setSizes([int(splitter.width() * 0.3), int(splitter.width() * 0.7)])
         layout = q.QHBoxLayout(self)
         layout.addWidget(splitter)
@@ -182,15 +245,57 @@ class FlowchartView(q.QWidget):
         self.flow_data.flowDataChanged.connect(lambda reason: self.refreshParamModel())
 
         self.reloadedSignal.connect(self.onWebViewReloaded)
+        self.selectRequested.connect(self.ensureEventLoaded)
 
     def onEventParamVisibilityChanged(self, show: bool) -> None:
         self.showEventParams = show
 
     def setIsCurrentView(self, is_current: bool) -> None:
         self.is_current = is_current
-        if is_current and self.update_timer.isActive():
-            self.update_timer.stop()
-            self.web_object.flowDataChanged.emit()
+        if is_current and self.needs_refresh:
+            self.scheduleRefresh()
+
+    def scheduleRefresh(self) -> None:
+        """Asks the view to reload the graph. Hidden views are only reloaded once they are shown."""
+        if not self.is_current:
+            self.needs_refresh = True
+            return
+        self.needs_refresh = False
+        if not self.refresh_timer.isActive():
+            self.refresh_timer.start()
+
+    def loadEntryPoints(self, ep_indices: typing.Iterable[int]) -> None:
+        if not self.web_object.isLazy():
+            return
+        names = {self.flow_data.flow.flowchart.entry_points[i].name for i in ep_indices}
+        if names - self.web_object.loaded_entry_points:
+            self.web_object.loaded_entry_points |= names
+            self.scheduleRefresh()
+
+    def loadEvents(self, events: typing.Iterable[Event]) -> None:
+        """Shows events (and the events that follow them) in lazy mode, even if no entry point reaches them."""
+        if not self.web_object.isLazy():
+            return
+        events = set(events)
+        if events - self.web_object.loaded_events:
+            self.web_object.loaded_events |= events
+            self.scheduleRefresh()
+
+    def ensureEventLoaded(self, idx: int) -> None:
+        if idx < 0 or not self.web_object.isLazy():
+            return
+        flowchart = self.flow_data.flow.flowchart
+        event = flowchart.events[idx]
+        reachability = self.web_object.reachability
+        if any(event in reachability.get(ep) for ep in flowchart.entry_points if ep.name in self.web_object.loaded_entry_points):
+            return
+        if any(event in reachability.get(e) for e in self.web_object.loaded_events):
+            return
+        for i, ep in enumerate(flowchart.entry_points):
+            if event in reachability.get(ep):
+                self.loadEntryPoints([i])
+                return
+        self.loadEvents([event])
 
     def export(self) -> None:
         if not self.flow_data.flow:
@@ -198,10 +303,10 @@ class FlowchartView(q.QWidget):
         path = q.QFileDialog.getSaveFileName(self, 'Select a location for the graph data', self.flow_data.flow.name + '.json', 'Data (*.json)')[0]
         if not path:
             return
-        data = self.web_object.getData()
+        data = fg.get_graph(self.flow_data.flow)
         try:
             with open(path, 'w') as f:
-                json.dump(data, f, default=lambda x: str(x))
+                fg.dump_graph(data, f)
         except:
             q.QMessageBox.critical(self, 'Export graph data', 'Failed to write to ' + path)
     
@@ -215,8 +320,30 @@ class FlowchartView(q.QWidget):
         ft.reorder_event_flow_parameters(self.flow_data.flow)
         self.flow_data.flowDataChanged.emit(FlowDataChangeReason.EventParameters)
 
+    def createWebView(self) -> None:
+        """Creates the web view (if it does not exist yet). It will emit readySignal once it has loaded."""
+        if self.view:
+            return
+        # PyQt5.QtWebEngineWidgets is slow to import, and importing it after the QApplication has been
+        # created requires Qt.AA_ShareOpenGLContexts (see main).
+        from PyQt5.QtWebChannel import QWebChannel # type: ignore
+        from PyQt5.QtWebEngineWidgets import QWebEngineView # type: ignore
+        self.view = QWebEngineView()
+        self.view.setContextMenuPolicy(qc.Qt.NoContextMenu)
+        self.channel = QWebChannel()
+        self.channel.registerObject('widget', self.web_object)
+        self.view.page().setWebChannel(self.channel)
+        self.view.page().setBackgroundColor(qg.QColor(0x38, 0x38, 0x38));
+        self.view.setUrl(qc.QUrl.fromLocalFile(get_path('assets/index.html')))
+        self.view_layout.addWidget(self.view)
+
+    def showEvent(self, event) -> None:
+        super().showEvent(event)
+        self.createWebView()
+
     def reload(self) -> None:
-        self.view.reload()
+        if self.view:
+            self.view.reload()
 
     def onWebViewReloaded(self) -> None:
         if not self.selected_event or not self.flow_data.flow or not self.flow_data.flow.flowchart:
@@ -251,21 +378,26 @@ class FlowchartView(q.QWidget):
         self.container_stacked_widget.setCurrentIndex(0)
 
     def onFlowDataChanged(self, reason: FlowDataChangeReason) -> None:
+        # Sending the entire graph is cheaper than a diff if everything has changed.
+        if reason & FlowDataChangeReason.Reset:
+            self.web_object.graph_differ.reset()
+            self.web_object.loaded_entry_points.clear()
+            self.web_object.loaded_events.clear()
+        if reason & (FlowDataChangeReason.Reset|FlowDataChangeReason.Events):
+            self.web_object.reachability.clear()
         should_reload = bool(reason & (FlowDataChangeReason.Reset|FlowDataChangeReason.Actors|FlowDataChangeReason.Events))
         if self.showEventParams:
             should_reload = should_reload or bool(reason & FlowDataChangeReason.EventParameters)
-        if not should_reload:
-            return
-        if self.is_current:
-            self.web_object.flowDataChanged.emit()
-        else:
-            self.update_timer.start(15*1000)
+        if should_reload:
+            self.scheduleRefresh()
 
     def onEntryPointSelected(self, selected, deselected) -> None:
         if len(selected.indexes()) != 1:
             return
         idx = selected.indexes()[0]
-        self.selectRequested.emit(-1000-self.ep_proxy_model.mapToSource(idx).row())
+        row = self.ep_proxy_model.mapToSource(idx).row()
+        self.loadEntryPoints([row])
+        self.selectRequested.emit(-1000-row)
 
     def delayedSelect(self, event: Event) -> None:
         try:
@@ -299,7 +431,11 @@ class FlowchartView(q.QWidget):
             q.QMessageBox.critical(self, 'Bug', f'An error has occurred: {e}\n\nPlease report this issue and mention what you were doing when this message showed up.')
 
     def addNewEvent(self) -> typing.Optional[Event]:
-        return add_new_event(self, self.flow_data)
+        event = add_new_event(self, self.flow_data)
+        if event:
+            # New events are not linked from anywhere yet.
+            self.loadEvents([event])
+        return event
 
     def webAddEventAbove(self, parent_indices: typing.List[int], event_idx: int) -> None:
         if event_idx < 0:
@@ -614,4 +750,5 @@ class FlowchartView(q.QWidget):
 
         # Trigger a full model reset since we updated the underlying array directly.
         self.flow_data.event_model.set(self.flow_data.flow)
+        self.loadEvents([fork_event])
         self.flow_data.flowDataChanged.emit(FlowDataChangeReason.Events)
@@ -0,0 +1,443 @@
+import glob
+import itertools
+import json
+import os
+from pathlib import Path
+import re
+import threading
+import time
+import typing
+
+import eventeditor.flow_io as flow_io
+from evfl import Actor, ActorIdentifier, Argument, Container, Event, EventFlow, ActionEvent, SwitchEvent, ForkEvent, JoinEvent, SubFlowEvent
+from evfl.common import StringHolder, RequiredIndex
+from evfl.entry_point import EntryPoint
+from evfl.util import make_values_to_index_map
+
+# An autosave journal consists of a base snapshot (a regular gzipped event flow) and a log file.
+# The first line of the log identifies the base snapshot; every other line is a JSON record
+# that lists the actors, events and entry points that changed, encoded with indices instead of
+# object references. Recovering the flow means reading the base and replaying the records.
+#
+# Every journal session (one per opened flow) gets its own log, and every base snapshot gets its own
+# file, so that neither a new session nor a compaction can clobber data that is needed for recovery.
+
+JOURNAL_EXTENSION = flow_io.JOURNAL_EXTENSION
+_TABLES = ('actors', 'events', 'entry_points')
+# Tables that can be affected by each kind of change (see FlowDataChangeReason).
+# Any other reason (or a combination that includes one) causes every table to be compared.
+_TABLES_BY_REASON = {
+    'Actors': ('actors', 'events'),
+    'Events': _TABLES,
+    'EventParameters': ('events',),
+    'EventFlowRename': (),
+}
+# Number of journal sessions that are kept for each flow name.
+_MAX_SESSIONS = 10
+_session_ids = itertools.count()
+_SESSION_RE = re.compile(r'\d{8}-\d{6}-\d+-\d+')
+
+def is_journal_path(path: str) -> bool:
+    return path.endswith(JOURNAL_EXTENSION)
+
+def get_journal_paths(directory: Path, name: str, session: str, generation: int) -> typing.Tuple[Path, Path]:
+    """Returns the paths to a base snapshot and to the log of a journal session."""
+    return (directory/f'autosave_{name}_{session}_{generation}.bfevfl.gz', directory/f'autosave_{name}_{session}{JOURNAL_EXTENSION}')
+
+def _get_tables_for_reason(reason: typing.Any) -> typing.Tuple[str, ...]:
+    names = [member.name for member in type(reason) if member & reason] if reason else []
+    if not names or any(name not in _TABLES_BY_REASON for name in names):
+        return _TABLES
+    return tuple(table for table in _TABLES if any(table in _TABLES_BY_REASON[name] for name in names))
+
+def _encode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, Argument):
+        return {'argument': str(value)}
+    if isinstance(value, ActorIdentifier):
+        return {'actor': [value.name, value.sub_name]}
+    return value
+
+def _decode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, dict):
+        if 'argument' in value:
+            return Argument(value['argument'])
+        return ActorIdentifier(*value['actor'])
+    return value
+
+def _encode_container(container: typing.Optional[Container]) -> typing.Optional[list]:
+    if container is None:
+        return None
+    return [[key, _encode_value(value)] for key, value in container.data.items()]
+
+def _decode_container(items: typing.Optional[list]) -> typing.Optional[Container]:
+    if items is None:
+        return None
+    container = Container()
+    for key, value in items:
+        container.data[key] = _decode_value(value)
+    return container
+
+class _FlowEncoder:
+    def __init__(self, flow: EventFlow) -> None:
+        assert flow.flowchart
+        self.flowchart = flow.flowchart
+        self.actor_idx = make_values_to_index_map(self.flowchart.actors)
+        self.event_idx = make_values_to_index_map(self.flowchart.events)
+        self.entry_point_idx = make_values_to_index_map(self.flowchart.entry_points)
+
+    def _event(self, event: typing.Optional[Event]) -> typing.Optional[int]:
+        return self.event_idx[event] if event else None
+
+    def encode_actor(self, actor: Actor) -> dict:
+        return {
+            'identifier': [actor.identifier.name, actor.identifier.sub_name],
+            'argument_name': actor.argument_name,
+            'argument_entry_point': self.entry_point_idx[actor.argument_entry_point.v] if actor.argument_entry_point.v else None,
+            'actions': [x.v for x in actor.actions],
+            'queries': [x.v for x in actor.queries],
+            'params': _encode_container(actor.params),
+            'concurrent_clips': actor.concurrent_clips,
+        }
+
+    def encode_event(self, event: Event) -> dict:
+        data = event.data
+        if isinstance(data, ActionEvent):
+            return {
+                'name': event.name, 'type': 'action', 'nxt': self._event(data.nxt.v),
+                'actor': self.actor_idx[data.actor.v], 'action': data.actor.v.actions.index(data.actor_action.v),
+                'params': _encode_container(data.params),
+            }
+        if isinstance(data, SwitchEvent):
+            return {
+                'name': event.name, 'type': 'switch',
+                'actor': self.actor_idx[data.actor.v], 'query': data.actor.v.queries.index(data.actor_query.v),
+                'params': _encode_container(data.params),
+                'cases': [[value, self._event(case.v)] for value, case in data.cases.items()],
+            }
+        if isinstance(data, ForkEvent):
+            return {
+                'name': event.name, 'type': 'fork',
+                'forks': [self._event(fork.v) for fork in data.forks], 'join': self._event(data.join.v),
+            }
+        if isinstance(data, JoinEvent):
+            return {'name': event.name, 'type': 'join', 'nxt': self._event(data.nxt.v)}
+        if isinstance(data, SubFlowEvent):
+            return {
+                'name': event.name, 'type': 'sub_flow', 'nxt': self._event(data.nxt.v),
+                'params': _encode_container(data.params),
+                'res_flowchart_name': data.res_flowchart_name, 'entry_point_name': data.entry_point_name,
+            }
+        raise ValueError(f'Unknown event type: {type(data).__name__}')
+
+    def encode_entry_point(self, entry_point: EntryPoint) -> dict:
+        return {
+            'name': entry_point.name,
+            'main_event': self._event(entry_point.main_event.v),
+            'sub_flow_event_indices': list(entry_point._sub_flow_event_indices),
+        }
+
+    def encode_table(self, table: str) -> typing.List[dict]:
+        """Returns a snapshot of a table that does not reference any flow object."""
+        if table == 'actors':
+            return [self.encode_actor(x) for x in self.flowchart.actors]
+        if table == 'events':
+            return [self.encode_event(x) for x in self.flowchart.events]
+        return [self.encode_entry_point(x) for x in self.flowchart.entry_points]
+
+def _dump_table(items: typing.List[dict]) -> typing.List[str]:
+    return [json.dumps(item, separators=(',', ':')) for item in items]
+
+def _resize(l: list, size: int, factory: typing.Callable[[], typing.Any]) -> None:
+    del l[size:]
+    while len(l) < size:
+        l.append(factory())
+
+def _make_rindex(v: typing.Any) -> RequiredIndex:
+    ri: RequiredIndex = RequiredIndex()
+    ri.v = v
+    return ri
+
+def apply_record(flow: EventFlow, record: dict) -> None:
+    """Applies a journal record to a flow in place.
+
+    Objects are updated in place rather than replaced so that references from entities
+    that are not part of the record stay valid."""
+    assert flow.flowchart
+    fc = flow.flowchart
+    flow.name = record['name']
+    fc.name = record['flowchart_name']
+    _resize(fc.actors, record['counts'][0], Actor)
+    _resize(fc.events, record['counts'][1], Event)
+    _resize(fc.entry_points, record['counts'][2], lambda: EntryPoint(''))
+
+    def event(idx: typing.Optional[int]) -> typing.Optional[Event]:
+        return fc.events[idx] if idx is not None else None
+
+    def strings(old: typing.List[StringHolder], values: typing.List[str]) -> typing.List[StringHolder]:
+        # Keep existing holders: events that reference them by identity may not be in this record.
+        existing = {x.v: x for x in reversed(old)}
+        return [existing.get(v) or StringHolder(v) for v in values]
+
+    for idx, value in record['actors'].items():
+        actor = fc.actors[int(idx)]
+        actor.identifier = ActorIdentifier(*value['identifier'])
+        actor.argument_name = value['argument_name']
+        actor.argument_entry_point.v = fc.entry_points[value['argument_entry_point']] if value['argument_entry_point'] is not None else None
+        actor.actions = strings(actor.actions, value['actions'])
+        actor.queries = strings(actor.queries, value['queries'])
+        actor.params = _decode_container(value['params'])
+        actor.concurrent_clips = value['concurrent_clips']
+
+    for idx, value in record['events'].items():
+        e = fc.events[int(idx)]
+        e.name = value['name']
+        etype = value['type']
+        if etype == 'action':
+            e.data = ActionEvent()
+            e.data.nxt.v = event(value['nxt'])
+            e.data.actor.v = fc.actors[value['actor']]
+            e.data.actor_action.v = e.data.actor.v.actions[value['action']]
+            e.data.params = _decode_container(value['params'])
+        elif etype == 'switch':
+            e.data = SwitchEvent()
+            e.data.actor.v = fc.actors[value['actor']]
+            e.data.actor_query.v = e.data.actor.v.queries[value['query']]
+            e.data.params = _decode_container(value['params'])
+            for case_value, case in value['cases']:
+                e.data.cases[case_value] = _make_rindex(event(case))
+        elif etype == 'fork':
+            e.data = ForkEvent()
+            e.data.forks = [_make_rindex(event(x)) for x in value['forks']]
+            e.data.join.v = event(value['join'])
+        elif etype == 'join':
+            e.data = JoinEvent()
+            e.data.nxt.v = event(value['nxt'])
+        elif etype == 'sub_flow':
+            e.data = SubFlowEvent()
+            e.data.nxt.v = event(value['nxt'])
+            e.data.params = _decode_container(value['params'])
+            e.data.res_flowchart_name = value['res_flowchart_name']
+            e.data.entry_point_name = value['entry_point_name']
+
+    for idx, value in record['entry_points'].items():
+        entry_point = fc.entry_points[int(idx)]
+        entry_point.name = value['name']
+        entry_point.main_event.v = event(value['main_event'])
+        entry_point._sub_flow_event_indices = list(value['sub_flow_event_indices'])
+
+def _remove_session(log_path: str) -> None:
+    try:
+        with open(log_path, 'rt') as f:
+            base_name = json.loads(f.readline())['base']
+        os.remove(os.path.join(os.path.dirname(log_path), base_name))
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        os.remove(log_path)
+    except OSError:
+        pass
+
+def read_journal(path: str, flow: EventFlow) -> int:
+    """Recovers a flow from a journal. Returns the number of records that were replayed.
+
+    Replay stops at the first incomplete record (e.g. if the application was killed while appending)."""
+    with open(path, 'rt') as f:
+        lines = f.read().split('\n')
+    header = json.loads(lines[0])
+    base_path = os.path.join(os.path.dirname(path), header['base'])
+    data = flow_io.read_flow_data(base_path)
+    if flow_io.get_flow_data_digest(data).hex() != header['digest']:
+        raise ValueError('The journal does not match its base snapshot')
+    flow.read(data) # type: ignore
+
+    num_records = 0
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break
+        apply_record(flow, record)
+        num_records += 1
+    return num_records
+
+class _PendingBase(typing.NamedTuple):
+    base_path: Path
+    log_path: Path
+    data: bytes
+    tables: typing.Dict[str, typing.List[dict]]
+
+class _PendingRecord(typing.NamedTuple):
+    record: typing.Dict[str, typing.Any]
+    tables: typing.Dict[str, typing.List[dict]]
+
+class Journal:
+    """Keeps track of what has been written to an autosave journal.
+
+    prepare() takes a snapshot of the tables that may have changed on the calling thread.
+    Comparing it with what has already been written and writing the changes is done by
+    write_pending(), which is intended to be called from a worker thread.
+
+    Nothing is written until prepare() is called, i.e. until the flow has actually been edited."""
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+        self._lock = threading.Lock()
+        # Only used by prepare().
+        self._flow: typing.Optional[EventFlow] = None
+        self._name = ''
+        self._session = ''
+        self._generation = 0
+        self._counts: typing.List[int] = []
+        # Only used by write_pending().
+        self._tables: typing.Dict[str, typing.List[str]] = dict()
+        self._base_path: typing.Optional[Path] = None
+        self._log_path: typing.Optional[Path] = None
+        self._broken = False
+        # Shared; protected by _lock.
+        self._pending: typing.List[typing.Union[_PendingBase, _PendingRecord]] = []
+        self._needs_base = False
+        self._base_size = 0
+        self._log_size = 0
+        self.compaction_ratio = 0.5
+
+    def reset(self) -> None:
+        """Makes the next call to prepare() start a new journal session."""
+        self._flow = None
+
+    @staticmethod
+    def supports(flow: EventFlow) -> bool:
+        """Only flowcharts can be journalled (not timelines)."""
+        return bool(flow.flowchart)
+
+    def prepare(self, flow: EventFlow, reason: typing.Any = None) -> bool:
+        """Records changes since the last call. Returns True if there is something to write.
+
+        reason (a FlowDataChangeReason) is used to skip tables that cannot have changed."""
+        if not self.supports(flow):
+            return False
+        assert flow.flowchart
+        encoder = _FlowEncoder(flow)
+        counts = [len(flow.flowchart.actors), len(flow.flowchart.events), len(flow.flowchart.entry_points)]
+
+        with self._lock:
+            # Start over if records could not be written, and compact the log once it gets too large
+            # compared to the base snapshot, so that recovery does not need to replay too much.
+            needs_base = self._needs_base or self._log_size > self._base_size * self.compaction_ratio
+            self._needs_base = False
+
+        if flow is not self._flow or flow.name != self._name or needs_base:
+            if flow is not self._flow or flow.name != self._name:
+                self._session = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(_session_ids)}'
+                self._generation = 0
+            else:
+                self._generation += 1
+            data = flow_io.serialize_flow(flow)
+            base_path, log_path = get_journal_paths(self._directory, flow.name, self._session, self._generation)
+            tables = {table: encoder.encode_table(table) for table in _TABLES}
+            with self._lock:
+                self._pending.append(_PendingBase(base_path, log_path, data, tables))
+                self._base_size = len(data)
+                self._log_size = 0
+            self._flow = flow
+            self._name = flow.name
+            self._counts = counts
+            return True
+
+        # A table whose size changed is always compared, so that the counts in a record never
+        # refer to entries that are missing from the log.
+        selected = _get_tables_for_reason(reason)
+        tables = {table: encoder.encode_table(table) for i, table in enumerate(_TABLES)
+                  if table in selected or counts[i] != self._counts[i]}
+        record: typing.Dict[str, typing.Any] = {
+            'reason': str(reason),
+            'name': flow.name,
+            'flowchart_name': flow.flowchart.name,
+            'counts': counts,
+        }
+        self._counts = counts
+        with self._lock:
+            self._pending.append(_PendingRecord(record, tables))
+        return True
+
+    def write_pending(self, compresslevel: int = 9) -> None:
+        with self._lock:
+            pending = self._pending
+            self._pending = []
+
+        try:
+            lines: typing.List[str] = []
+            for item in pending:
+                if isinstance(item, _PendingBase):
+                    self._append(lines)
+                    lines = []
+                    self._write_base(item, compresslevel)
+                elif not self._broken:
+                    line = self._diff(item)
+                    if line:
+                        lines.append(line)
+            self._append(lines)
+        except:
+            # Records have been lost, so the log cannot be trusted anymore. Start over next time.
+            self._broken = True
+            with self._lock:
+                self._needs_base = True
+            raise
+
+    def _write_base(self, item: _PendingBase, compresslevel: int) -> None:
+        # Write the new base under its own name first, then atomically switch the log over to it,
+        # and only then remove the previous base: a crash at any point leaves a consistent journal.
+        flow_io.write_flow_data(str(item.base_path), item.data, compresslevel=compresslevel)
+        header = json.dumps({'base': item.base_path.name, 'digest': flow_io.get_flow_data_digest(item.data).hex()})
+        with open(str(item.log_path) + '.tmp', 'wt') as f:
+            f.write(header + '\n')
+        os.replace(str(item.log_path) + '.tmp', item.log_path)
+
+        old_base_path = self._base_path
+        is_new_session = item.log_path != self._log_path
+        self._base_path = item.base_path
+        self._log_path = item.log_path
+        self._tables = {table: _dump_table(items) for table, items in item.tables.items()}
+        self._broken = False
+        with self._lock:
+            self._log_size += len(header)
+
+        if is_new_session:
+            self._remove_old_sessions(item.log_path)
+        elif old_base_path and old_base_path != item.base_path:
+            try:
+                old_base_path.unlink()
+            except OSError:
+                pass
+
+    def _remove_old_sessions(self, log_path: Path) -> None:
+        prefix = log_path.name[:-len(JOURNAL_EXTENSION)].rsplit('_', 1)[0] + '_'
+        paths = glob.glob(os.path.join(glob.escape(str(self._directory)), glob.escape(prefix) + '*' + JOURNAL_EXTENSION))
+        # Ignore sessions of other flows whose name merely starts with the same prefix.
+        paths = [path for path in paths if _SESSION_RE.fullmatch(os.path.basename(path)[len(prefix):-len(JOURNAL_EXTENSION)])]
+        paths.sort(key=lambda path: os.stat(path).st_mtime if os.path.exists(path) else 0, reverse=True)
+        for path in paths[_MAX_SESSIONS:]:
+            if path != str(log_path):
+                _remove_session(path)
+
+    def _diff(self, item: _PendingRecord) -> typing.Optional[str]:
+        record = dict(item.record)
+        changed = False
+        for table in _TABLES:
+            if table not in item.tables:
+                record[table] = dict()
+                continue
+            old = self._tables[table]
+            new = _dump_table(item.tables[table])
+            record[table] = {str(i): json.loads(x) for i, x in enumerate(new) if i >= len(old) or old[i] != x}
+            changed = changed or bool(record[table]) or len(old) != len(new)
+            self._tables[table] = new
+        if not changed:
+            return None
+        return json.dumps(record, separators=(',', ':'))
+
+    def _append(self, lines: typing.List[str]) -> None:
+        if not lines or not self._log_path:
+            return
+        with open(self._log_path, 'at') as f:
+            f.write('\n'.join(lines) + '\n')
+        with self._lock:
+            self._log_size += sum(len(line) for line in lines)
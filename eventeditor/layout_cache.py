@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import traceback
+import typing
+
+# Layouts are computed by the flowchart view (assets/layout.js), which also computes the keys.
+# This module only stores them. It must not depend on Qt.
+
+class LayoutCache:
+    """Persistent cache of flowchart component layouts.
+
+    Entries are kept as JSON text and evicted in least recently used order once there are more than
+    max_entries or once they take up more than max_size bytes."""
+    def __init__(self, path: str, max_size: int, max_entries: int = 20000) -> None:
+        self._path = path
+        self._max_size = max_size
+        self._max_entries = max_entries
+        self._entries: typing.Dict[str, str] = dict()
+        self._size = 0
+        self._dirty = False
+        try:
+            with open(path, 'r') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                for key, layout in entries.items():
+                    self._set(key, layout)
+                self._evict()
+        except FileNotFoundError:
+            pass
+        except:
+            sys.stderr.write(f'Failed to load layout cache\n{traceback.format_exc()}\n')
+
+    def get_json(self) -> str:
+        return '{' + ','.join(f'{json.dumps(key)}:{layout}' for key, layout in self._entries.items()) + '}'
+
+    def update(self, entries: typing.Dict[str, typing.Any], used_keys: typing.Iterable[str] = ()) -> None:
+        """Stores new layouts and marks the layouts that were used as recently used."""
+        for key in used_keys:
+            layout = self._entries.pop(key, None)
+            if layout is not None:
+                self._entries[key] = layout
+                self._dirty = True
+        for key, layout in entries.items():
+            self._set(key, layout)
+        self._evict()
+        self._dirty = self._dirty or bool(entries)
+
+    def _set(self, key: str, layout: typing.Any) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(key) + len(old)
+        text = json.dumps(layout, separators=(',', ':'))
+        self._entries[key] = text
+        self._size += len(key) + len(text)
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self._max_entries or self._size > self._max_size):
+            key = next(iter(self._entries))
+            self._size -= len(key) + len(self._entries.pop(key))
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            with open(self._path + '.tmp', 'w') as f:
+                f.write(self.get_json())
+            os.replace(self._path + '.tmp', self._path)
+            self._dirty = False
+        except:
+            sys.stderr.write(f'Failed to save layout cache\n{traceback.format_exc()}\n')
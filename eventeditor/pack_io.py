@@ -0,0 +1,216 @@
+import collections
+import mmap
+import os
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    import oead
+
+# Separates the path of an archive from the name of a file inside it, e.g.
+# Pack/Bootup.pack//EventFlow/Foo.bfevfl. Archives can be nested:
+# Pack/TitleBG.pack//Event/Foo.sbeventpack//EventFlow/Foo.bfevfl
+PACK_PATH_SEPARATOR = '//'
+PACK_EXTENSIONS = ('.pack', '.sbeventpack', '.sarc', '.ssarc')
+
+_ARCHIVE_CACHE_SIZE = 256 << 20
+# Level 6 is about twice as fast as the default (7) and compresses almost as well.
+_YAZ0_COMPRESSION_LEVEL = 6
+
+def _find_pack_path_separator(path: str, start: int) -> int:
+    """Returns the index of the first separator at or after start that follows an archive name, or -1.
+    Other double slashes (e.g. /home/user//Foo.bfevfl) are just part of the path."""
+    idx = path.find(PACK_PATH_SEPARATOR, start)
+    while idx != -1 and not is_pack_archive(path[:idx]):
+        idx = path.find(PACK_PATH_SEPARATOR, idx + 1)
+    return idx
+
+def is_pack_path(path: str) -> bool:
+    # Skip the first character so that UNC paths (//server/share) are not mistaken for pack paths.
+    return _find_pack_path_separator(path, 1) != -1
+
+def is_pack_archive(path: str) -> bool:
+    return path.lower().endswith(PACK_EXTENSIONS)
+
+def split_pack_path(path: str) -> typing.Tuple[str, typing.List[str]]:
+    """Returns the path of the archive on disk and the names of the files inside it."""
+    idx = _find_pack_path_separator(path, 1)
+    if idx == -1:
+        return (path, [])
+    archive_path = path[:idx]
+    names: typing.List[str] = []
+    start = idx + len(PACK_PATH_SEPARATOR)
+    idx = _find_pack_path_separator(path, start)
+    while idx != -1:
+        names.append(path[start:idx])
+        start = idx + len(PACK_PATH_SEPARATOR)
+        idx = _find_pack_path_separator(path, start)
+    names.append(path[start:])
+    return (archive_path, names)
+
+def join_pack_path(archive_path: str, *names: str) -> str:
+    return PACK_PATH_SEPARATOR.join((archive_path,) + names)
+
+def _is_yaz0(data) -> bool:
+    return data[:4] == b'Yaz0'
+
+class _ArchiveCache:
+    """LRU cache of decompressed archives, bounded by the total size of the decompressed data."""
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: 'collections.OrderedDict[tuple, typing.Tuple[oead.Sarc, bytes]]' = collections.OrderedDict()
+        self._size = 0
+
+    def get(self, key: tuple) -> 'typing.Optional[oead.Sarc]':
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: tuple, data: bytes) -> 'oead.Sarc':
+        import oead
+        sarc = oead.Sarc(data)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= len(old_entry[1])
+            # The Sarc only references data, so it must be kept alive for as long as the Sarc is.
+            self._entries[key] = (sarc, data)
+            self._size += len(data)
+            while self._size > self.max_size and len(self._entries) > 1:
+                _, (_, evicted_data) = self._entries.popitem(last=False)
+                self._size -= len(evicted_data)
+        return sarc
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+_archive_cache = _ArchiveCache(_ARCHIVE_CACHE_SIZE)
+
+def clear_cache() -> None:
+    _archive_cache.clear()
+
+def _get_archive_key(archive_path: str) -> tuple:
+    st = os.stat(archive_path)
+    return (os.path.abspath(archive_path), st.st_mtime_ns, st.st_size)
+
+def _get_entry_data(sarc: 'oead.Sarc', name: str, path: str) -> bytes:
+    import oead
+    entry = sarc.get_file(name)
+    if entry is None:
+        raise FileNotFoundError(f'{name} does not exist in {path}')
+    if _is_yaz0(entry.data):
+        return oead.yaz0.decompress(entry.data)
+    return bytes(entry.data)
+
+def _open_archives(archive_path: str, names: typing.Sequence[str]) -> 'typing.List[oead.Sarc]':
+    """Opens archive_path and the archives that are found by following names (a list of nested archives).
+    Returns one Sarc per level, from the outermost to the innermost archive."""
+    import oead
+    key = _get_archive_key(archive_path)
+    sarc = _archive_cache.get(key)
+    if sarc is None:
+        with open(archive_path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if _is_yaz0(data):
+            with data:
+                sarc = _archive_cache.put(key, oead.yaz0.decompress(data))
+        else:
+            # Uncompressed archives are cheap to open, so they are read through the mapping
+            # without being cached. Only the entries that are accessed are paged in.
+            sarc = oead.Sarc(data)
+
+    sarcs = [sarc]
+    path = archive_path
+    for name in names:
+        path = join_pack_path(path, name)
+        key += (name,)
+        nested_sarc = _archive_cache.get(key)
+        if nested_sarc is None:
+            nested_sarc = _archive_cache.put(key, _get_entry_data(sarcs[-1], name, path))
+        sarcs.append(nested_sarc)
+    return sarcs
+
+def _open_archive(archive_path: str, names: typing.Sequence[str]) -> 'oead.Sarc':
+    return _open_archives(archive_path, names)[-1]
+
+def read_pack_file(path: str) -> bytes:
+    """Returns the (decompressed) contents of a file inside an archive, given a pack path."""
+    archive_path, names = split_pack_path(path)
+    if not names:
+        raise ValueError(f'{path} does not refer to a file inside an archive')
+    sarc = _open_archive(archive_path, names[:-1])
+    return _get_entry_data(sarc, names[-1], path)
+
+def list_pack_files(path: str, extension: str = '.bfevfl') -> typing.List[str]:
+    """Returns the pack paths of the files with the specified extension inside an archive."""
+    archive_path, names = split_pack_path(path)
+    sarc = _open_archive(archive_path, names)
+    return sorted(join_pack_path(path, f.name) for f in sarc.get_files() if f.name.endswith(extension))
+
+def _repack(archive_path: str, names: typing.Sequence[str], data: bytes) -> typing.Optional[typing.List[typing.Tuple[int, bytes]]]:
+    """Rebuilds every archive level with the file replaced by data, from the innermost archive outwards.
+    Returns (alignment, data) for each level from the outermost one, or None if the file is unchanged."""
+    import oead
+    sarcs = _open_archives(archive_path, names[:-1])
+    entry = sarcs[-1].get_file(names[-1])
+    if entry is not None and (oead.yaz0.decompress(entry.data) if _is_yaz0(entry.data) else entry.data) == data:
+        return None
+
+    levels: typing.List[typing.Tuple[int, bytes]] = []
+    new_data, alignment = data, 0
+    for sarc, name in zip(reversed(sarcs), reversed(names)):
+        entry = sarc.get_file(name)
+        # Keep compressed entries compressed (e.g. .sbeventpack files inside TitleBG.pack).
+        entry_data = new_data
+        if entry is not None and _is_yaz0(entry.data):
+            entry_data = oead.yaz0.compress(new_data, alignment, _YAZ0_COMPRESSION_LEVEL)
+        # The other entries are copied as they are, without being decompressed or recompressed.
+        writer = oead.SarcWriter.from_sarc(sarc)
+        writer.files[name] = entry_data
+        alignment, new_data = writer.write()
+        levels.append((alignment, new_data))
+    levels.reverse()
+    return levels
+
+def write_pack_file(path: str, data: bytes) -> bool:
+    """Replaces a file inside an archive, given a pack path. The archive is written atomically.
+
+    Returns False without touching the disk if the file already contains exactly this data."""
+    import oead
+    archive_path, names = split_pack_path(path)
+    if not names:
+        raise ValueError(f'{path} does not refer to a file inside an archive')
+
+    levels = _repack(archive_path, names, data)
+    if levels is None:
+        return False
+
+    with open(archive_path, 'rb') as f:
+        is_compressed = _is_yaz0(f.read(4))
+    alignment, archive_data = levels[0]
+    out_data = oead.yaz0.compress(archive_data, alignment, _YAZ0_COMPRESSION_LEVEL) if is_compressed else archive_data
+
+    tmp_path = archive_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(out_data)
+        os.replace(tmp_path, archive_path)
+    except:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Seed the cache with the archives we have just built so that they do not need to be decompressed again.
+    key = _get_archive_key(archive_path)
+    for i, (_, level_data) in enumerate(levels):
+        if i != 0 or is_compressed:
+            _archive_cache.put(key + tuple(names[:i]), level_data)
+    return True
@@ -0,0 +1,24 @@
+import sys
+import time
+import typing
+
+class StartupProfiler:
+    """Records how long each phase of startup takes (see --profile-startup)."""
+    def __init__(self, start: float) -> None:
+        self._start = start
+        self._last = start
+        self.phases: typing.List[typing.Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        """Records the time since the previous mark (or the start) as the duration of phase."""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def total_ms(self) -> float:
+        return (self._last - self._start) * 1000
+
+    def report(self, file: typing.TextIO = sys.stderr) -> None:
+        for phase, duration in self.phases:
+            print(f'{phase:<20} {duration * 1000:8.1f} ms', file=file)
+        print(f'{"total":<20} {self.total_ms():8.1f} ms', file=file)
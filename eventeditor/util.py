@@ -1,39 +1,12 @@
 import evfl.evfl
 import evfl.actor
 import evfl.event
-import gzip
-import io
+from eventeditor.flow_io import read_flow, write_flow, write_flow_data, serialize_flow, get_flow_data_digest
 import os
 import typing
 import PyQt5.QtCore as qc # type: ignore
 import PyQt5.QtWidgets as q # type: ignore
 
-def read_flow(path: str, flow: evfl.evfl.EventFlow):
-    if path.endswith('.gz'):
-        with gzip.open(path, 'rb') as f:
-            flow.read(f.read())
-    else:
-        with open(path, 'rb') as f:
-            flow.read(f.read())
-
-def write_flow(path: str, flow: evfl.evfl.EventFlow):
-    try:
-        if path.endswith('.gz'):
-            buf = io.BytesIO()
-            flow.write(buf)
-            with gzip.open(path + '.tmp', 'wb') as f:
-                f.write(buf.getbuffer())
-        else:
-            with open(path + '.tmp', 'wb') as f:
-                flow.write(f)
-        os.replace(path + '.tmp', path)
-    except:
-        try:
-            os.unlink(path + '.tmp')
-        except FileNotFoundError:
-            pass
-        raise
-
 def get_path(rel_path: str):
     return os.path.join(os.path.dirname(os.path.realpath(__file__)), rel_path)
 
@@ -31,8 +31,11 @@ setuptools.setup(
         'byml~=2.0',
         'oead~=1.1',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     entry_points={
+        'console_scripts': [
+            'eventeditor-batch = eventeditor.batch:main'
+        ],
         'gui_scripts': [
             'eventeditor = eventeditor.__main__:main'
         ],
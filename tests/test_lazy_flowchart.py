@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# Use a throwaway configuration, so that the user's settings (e.g. flowchart/lazy_threshold) do not matter.
+_config_dir = tempfile.TemporaryDirectory()
+os.environ['XDG_CONFIG_HOME'] = _config_dir.name
+os.environ['XDG_DATA_HOME'] = _config_dir.name
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from evfl import Event, EventFlow, Flowchart, SubFlowEvent
+from evfl.entry_point import EntryPoint
+# Must be imported before the QApplication is created.
+try:
+    import PyQt5.QtWebEngineWidgets # type: ignore
+    HAS_WEB_ENGINE = True
+except ImportError:
+    HAS_WEB_ENGINE = False
+import PyQt5.QtWidgets as q # type: ignore
+
+from eventeditor.flow_data import FlowData
+import eventeditor.flowchart_graph as fg
+from eventeditor.flowchart_view import FlowchartView
+
+def make_event(name: str) -> Event:
+    event = Event()
+    event.name = name
+    event.data = SubFlowEvent()
+    event.data.entry_point_name = name
+    return event
+
+def make_flow(num_entry_points: int) -> EventFlow:
+    flow = EventFlow()
+    flow.name = 'Test'
+    flow.flowchart = Flowchart()
+    flow.flowchart.name = 'Test'
+    for i in range(num_entry_points):
+        event = make_event(f'Event{i}')
+        entry_point = EntryPoint(f'EntryPoint{i}')
+        entry_point.main_event.v = event
+        flow.flowchart.events.append(event)
+        flow.flowchart.entry_points.append(entry_point)
+    return flow
+
+def get_node_ids(graph: list) -> set:
+    return {e['id'] for e in graph if e['type'] == 'node' and not e['data'].get('unloaded')}
+
+class PartialGraphTest(unittest.TestCase):
+    def test_extra_events_are_included(self) -> None:
+        flow = make_flow(3)
+        orphan = make_event('Orphan')
+        follower = make_event('Follower')
+        orphan.data.nxt.v = follower
+        flow.flowchart.events += [orphan, follower]
+        entry_points = [flow.flowchart.entry_points[1]]
+        self.assertEqual(get_node_ids(fg.get_graph(flow, entry_points)), {1, -1001})
+        self.assertEqual(get_node_ids(fg.get_graph(flow, entry_points, events=[orphan])), {1, -1001, 3, 4})
+
+@unittest.skipUnless(HAS_WEB_ENGINE, 'QtWebEngine is not available')
+class LazyFlowchartTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.app = q.QApplication.instance() or q.QApplication(sys.argv)
+
+    def setUp(self) -> None:
+        self.flow_data = FlowData()
+        self.view = FlowchartView(None, self.flow_data)
+        self.flow = make_flow(20)
+        self.flow_data.setFlow(self.flow)
+        self.assertTrue(self.view.web_object.isLazy())
+
+    def get_node_ids(self) -> set:
+        return get_node_ids(self.view.web_object.getData())
+
+    def test_selecting_event_loads_its_entry_point(self) -> None:
+        self.assertEqual(self.get_node_ids(), set())
+        self.view.selectRequested.emit(3)
+        self.assertEqual(self.get_node_ids(), {3, -1003})
+
+    def test_unreachable_event_is_shown_once_added(self) -> None:
+        event = make_event('New')
+        follower = make_event('Follower')
+        event.data.nxt.v = follower
+        self.flow_data.event_model.append(follower)
+        self.flow_data.event_model.append(event)
+        self.view.loadEvents([event])
+        self.assertEqual(self.get_node_ids(), {20, 21})
+
+    def test_unreachable_event_is_shown_once_selected(self) -> None:
+        self.flow_data.event_model.append(make_event('Orphan'))
+        self.view.selectRequested.emit(20)
+        self.assertEqual(self.get_node_ids(), {20})
+
+if __name__ == '__main__':
+    unittest.main()
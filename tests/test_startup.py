@@ -0,0 +1,68 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from evfl import Event, EventFlow, Flowchart, SubFlowEvent
+from evfl.entry_point import EntryPoint
+
+# Can be raised on slow machines (e.g. CI runners).
+STARTUP_BUDGET_MS = float(os.environ.get('EVENTEDITOR_STARTUP_BUDGET_MS', 3000))
+ROOT = Path(__file__).resolve().parent.parent
+
+def has_web_engine() -> bool:
+    # Importing QtWebEngine can abort the process, so check in a separate one.
+    return subprocess.run([sys.executable, '-c', 'import PyQt5.QtWebEngineWidgets'],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+def write_fixture_flow(path: str, num_entry_points: int = 50) -> None:
+    flow = EventFlow()
+    flow.name = 'StartupTest'
+    flow.flowchart = Flowchart()
+    flow.flowchart.name = 'StartupTest'
+    for i in range(num_entry_points):
+        event = Event()
+        event.name = f'Event{i}'
+        event.data = SubFlowEvent()
+        event.data.entry_point_name = f'EntryPoint{i}'
+        entry_point = EntryPoint(f'EntryPoint{i}')
+        entry_point.main_event.v = event
+        flow.flowchart.events.append(event)
+        flow.flowchart.entry_points.append(entry_point)
+    with open(path, 'wb') as f:
+        flow.write(f)
+
+class StartupTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # Keep the user's settings, autosaves and caches out of the measurement (and vice versa).
+        self.home = tempfile.TemporaryDirectory()
+        self.addCleanup(self.home.cleanup)
+
+    def run_startup(self, *args: str) -> subprocess.CompletedProcess:
+        env = dict(os.environ, QT_QPA_PLATFORM='offscreen',
+                   XDG_CONFIG_HOME=os.path.join(self.home.name, 'config'),
+                   XDG_DATA_HOME=os.path.join(self.home.name, 'data'),
+                   XDG_CACHE_HOME=os.path.join(self.home.name, 'cache'))
+        return subprocess.run([sys.executable, '-m', 'eventeditor', '--startup-budget', str(STARTUP_BUDGET_MS), *args],
+                              cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, timeout=120)
+
+    def test_startup_within_budget(self) -> None:
+        result = self.run_startup()
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('total', result.stderr)
+
+    @unittest.skipUnless(has_web_engine(), 'QtWebEngine is not available')
+    def test_startup_with_file_within_budget(self) -> None:
+        path = os.path.join(self.home.name, 'StartupTest.bfevfl')
+        write_fixture_flow(path)
+        result = self.run_startup(path)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertIn('first file loaded', result.stderr)
+        self.assertIn('web engine ready', result.stderr)
+        self.assertIn('total', result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()